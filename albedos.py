@@ -1,5 +1,11 @@
+import csv
+import os
+import threading
+
 import numpy as np
-import pandas as pd
+
+from cache import ArrayCache
+from stages import staged
 
 
 class Albedo:
@@ -32,37 +38,198 @@ class Albedo:
         return albedo
 
 
+class AlbedoTable:
+
+    def __init__(self, albedos, step=0.01, tolerance=5e-5):
+        self.step = step
+        self.zeniths = np.arange(0, 90 + step / 2, step)
+        curves = albedos.curves
+        self.names = tuple(curves)
+        values = np.stack([
+            np.interp(self.zeniths, curve.zeniths, curve.albedos)
+            for curve in curves.values()
+        ])
+        # Value and slope per table cell, so a lookup is one multiply-add
+        self._values = dict(zip(self.names, values[:, :-1].copy()))
+        self._slopes = dict(zip(self.names, np.diff(values, axis=1).copy()))
+        self._tables = {
+            self._values['cloud_ocean'].dtype: (self._values, self._slopes),
+        }
+        # Buffers are per thread so tiles can run concurrently
+        self._local = threading.local()
+        self.max_error = self._get_max_error(curves)
+        self.key = ArrayCache.make_key('albedo_table', step, values)
+        assert self.max_error <= tolerance
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(step={self.step}, ' \
+            f'max_error={self.max_error:.2g})'
+
+    def _get_max_error(self, curves):
+        zeniths = np.linspace(0, 90, 90001)
+        index, fraction = self._get_index(zeniths)
+        out = np.empty(zeniths.shape)
+        return max(
+            np.abs(
+                self._lookup(name, index, fraction, out) -
+                np.interp(zeniths, curve.zeniths, curve.albedos)
+            ).max()
+            for name, curve in curves.items()
+        )
+
+    def _get_index(self, zeniths):
+        position = np.multiply(zeniths, 1 / self.step)
+        np.clip(position, 0, self.zeniths.size - 1, out=position)
+        index = position.astype(np.intp)
+        np.minimum(index, self.zeniths.size - 2, out=index)
+        position -= index
+        return index, position
+
+    def _get_tables(self, dtype):
+        if dtype not in self._tables:
+            self._tables[dtype] = tuple(
+                {name: table.astype(dtype) for name, table in tables.items()}
+                for tables in (self._values, self._slopes)
+            )
+        return self._tables[dtype]
+
+    def _lookup(self, name, index, fraction, out):
+        values, slopes = self._get_tables(out.dtype)
+        np.take(slopes[name], index, out=out)
+        out *= fraction
+        out += np.take(values[name], index)
+        return out
+
+    def _get_buffers(self, shape, dtype):
+        size = int(np.prod(shape))
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or buffers.shape[1] < size or \
+                buffers.dtype != dtype:
+            buffers = self._local.buffers = np.empty((5, size), dtype=dtype)
+        return [buffer[:size].reshape(shape) for buffer in buffers]
+
+    @staged('albedos.table')
+    def get_albedos(self, zeniths, ice_thickness, temperature):
+        # Returns a_Ocld, a_Oclr, a_Icld, a_Iclr in reused buffers, which
+        # stay valid until the next call from the same thread
+        zeniths = np.ma.getdata(zeniths)
+        ice_thickness = np.ma.getdata(ice_thickness)
+        temperature = np.ma.getdata(temperature)
+        # Albedos follow the zenith precision
+        dtype = zeniths.dtype
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.dtype(np.float64)
+        a_Ocld, a_Oclr, a_Icld, a_Iclr, work = self._get_buffers(
+            zeniths.shape, dtype
+        )
+        index, fraction = self._get_index(zeniths)
+
+        has_melt = temperature >= (-1 + 273.15)
+        is_thin_ice = ice_thickness < 0.5
+        fh = np.arctan(4 * ice_thickness) / np.arctan(4 * .5)
+        np.minimum(fh, 1, out=fh)
+        dark = has_melt & ~is_thin_ice
+        bright = np.where(is_thin_ice, fh, ~has_melt)
+        sea = np.where(is_thin_ice, 1 - fh, 0)
+
+        skies = (
+            (a_Ocld, a_Icld, 'cloud_ocean', 'cloud_dark_ice',
+             'cloud_bright_ice'),
+            (a_Oclr, a_Iclr, 'clear_ocean', 'clear_dark_ice',
+             'clear_bright_ice'),
+        )
+        night = zeniths > 90
+        for sea_albedo, ice_albedo, ocean, dark_ice, bright_ice in skies:
+            self._lookup(ocean, index, fraction, sea_albedo)
+            sea_albedo[night] = 0
+            self._lookup(dark_ice, index, fraction, ice_albedo)
+            ice_albedo *= dark
+            ice_albedo += np.multiply(
+                self._lookup(bright_ice, index, fraction, work), bright,
+                out=work,
+            )
+            ice_albedo += np.multiply(sea_albedo, sea, out=work)
+            ice_albedo[night] = 0
+        return a_Ocld, a_Oclr, a_Icld, a_Iclr
+
+
 class Albedos:
 
-    def __init__(self, filepath=None):
+    def __init__(self, filepath=None, cache_dir=None):
         if filepath is None:
             filepath = 'Albedos.csv'
         self._filepath = filepath
-        self._albedos = pd.read_csv(filepath)
+        self._table = None
+        self._albedos = self._read_columns(filepath, cache_dir)
         self._clear_ocean = Albedo(
-            zeniths=self._albedos['Clear Sky Over Ocean X'].values,
-            albedos=self._albedos['Clear Sky Over Ocean Y'].values
+            zeniths=self._albedos['Clear Sky Over Ocean X'],
+            albedos=self._albedos['Clear Sky Over Ocean Y']
         )
         self._cloud_bright_ice = Albedo(
-            zeniths=self._albedos['Cloud Over Bright Sea Ice X'].values,
-            albedos=self._albedos['Cloud Over Bright Sea Ice Y'].values
+            zeniths=self._albedos['Cloud Over Bright Sea Ice X'],
+            albedos=self._albedos['Cloud Over Bright Sea Ice Y']
         )
         self._cloud_ocean = Albedo(
-            zeniths=self._albedos['Cloud Over Ocean X'].values,
-            albedos=self._albedos['Cloud Over Ocean Y'].values
+            zeniths=self._albedos['Cloud Over Ocean X'],
+            albedos=self._albedos['Cloud Over Ocean Y']
         )
         self._cloud_dark_ice = Albedo(
-            zeniths=self._albedos['Cloud Over Dark Sea Ice X'].values,
-            albedos=self._albedos['Cloud Over Dark Sea Ice Y'].values)
+            zeniths=self._albedos['Cloud Over Dark Sea Ice X'],
+            albedos=self._albedos['Cloud Over Dark Sea Ice Y'])
         self._clear_bright_ice = Albedo(
-            zeniths=self._albedos['Clear Sky Over Bright Ice X'].values,
-            albedos=self._albedos['Clear Sky Over Bright Ice Y'].values
+            zeniths=self._albedos['Clear Sky Over Bright Ice X'],
+            albedos=self._albedos['Clear Sky Over Bright Ice Y']
         )
         self._clear_dark_ice = Albedo(
-            zeniths=self._albedos['Clear Sky Over Dark Ice X'].values,
-            albedos=self._albedos['Clear Sky Over Dark Ice Y'].values,
+            zeniths=self._albedos['Clear Sky Over Dark Ice X'],
+            albedos=self._albedos['Clear Sky Over Dark Ice Y'],
         )
 
+    @staticmethod
+    def _read_columns(filepath, cache_dir=None):
+        # With a cache_dir the parsed curves are kept there as NumPy arrays,
+        # keyed on the contents of the CSV. Blank cells are NaN, as Albedo
+        # expects.
+        with open(filepath, 'rb') as stream:
+            content = stream.read()
+        cache_path = None
+        if cache_dir is not None:
+            key = ArrayCache.make_key('albedos', content)
+            cache_path = os.path.join(cache_dir, f'albedos_{key}.npz')
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as table:
+                    return dict(zip(table['names'], table['values'].T))
+        rows = list(csv.reader(content.decode().splitlines()))
+        names = rows[0]
+        values = np.array([
+            [float(value) if value else np.nan for value in row]
+            for row in rows[1:]
+        ])
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp.npz'
+            np.savez(tmp_path, names=np.array(names), values=values)
+            os.replace(tmp_path, cache_path)
+        return dict(zip(names, values.T))
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = AlbedoTable(self)
+        return self._table
+
+    @property
+    def curves(self):
+        return {
+            'clear_ocean': self._clear_ocean,
+            'cloud_ocean': self._cloud_ocean,
+            'clear_bright_ice': self._clear_bright_ice,
+            'cloud_bright_ice': self._cloud_bright_ice,
+            'clear_dark_ice': self._clear_dark_ice,
+            'cloud_dark_ice': self._cloud_dark_ice,
+        }
+
+    @staged('albedos.ice')
     def get_ice_albedo(self, zeniths, ice_thickness, temperature,
                        clear_sky=True, sea_albedo=None):
         if clear_sky:
@@ -105,6 +272,7 @@ class Albedos:
 
         return albedo
 
+    @staged('albedos.sea')
     def get_sea_albedo(self, zeniths, clear_sky=True):
         if clear_sky:
             ocean = self._clear_ocean
@@ -0,0 +1,171 @@
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import synthetic
+from albedos import Albedos
+from cmip5 import CMIP5
+from data_set import DataSet
+from net_forcing import (_get_E_integral, _get_lit_integral,
+                         get_radiative_forcing)
+
+# Times the main stages on synthetic inputs at a few resolutions, so results
+# can be compared between commits. Each timing is the best of REPEATS runs.
+DATA_DIR = 'benchmark_data'
+OUT_PATH = 'benchmark.json'
+RESOLUTIONS = {
+    'coarse': dict(ocean_step=3., atmosphere_step=4., cloud_step=8.),
+    'medium': dict(ocean_step=1., atmosphere_step=2., cloud_step=2.),
+}
+DELTA_TS = (3600, 1800, 600)
+# Full years are only run at the largest delta_t to keep the suite short
+YEAR_DELTA_TS = (3600,)
+START_DATE = datetime(1979, 1, 1)
+REPEATS = 3
+# Cold imports are timed in fresh interpreters against numpy alone
+IMPORTS = 'import net_forcing, data_set, albedos, parallel'
+COMPACT = True
+DTYPE = np.float64
+
+
+def _time(function, repeats=REPEATS):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _time_import(statement):
+    return _time(lambda: subprocess.run(
+        [sys.executable, '-c', statement], check=True
+    ))
+
+
+def _get_environment():
+    environment = {
+        'date': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+    }
+    try:
+        import numba
+        environment['numba'] = numba.__version__
+    except ImportError:
+        environment['numba'] = None
+    return environment
+
+
+def run_resolution(name, paths, results):
+    def add(stage, seconds, **params):
+        result = {'resolution': name, 'stage': stage, 'seconds': seconds}
+        result.update(params)
+        results.append(result)
+        print(json.dumps(result))
+
+    data_set_kwargs = dict(paths, sic_scale=.01, clt_scale=.01,
+                           compact=COMPACT, dtype=DTYPE)
+    add('startup', _time(lambda: DataSet(**data_set_kwargs).close(), 1))
+
+    sic = CMIP5(paths['sic_path'], .01)
+    tas = CMIP5(paths['tas_path'])
+    add(
+        'regrid',
+        _time(lambda: tas.set_grid_data(sic.lats, sic.lons), 1),
+        cells=sic.lats.size,
+    )
+
+    data_set = DataSet(**data_set_kwargs)
+    albedos = Albedos()
+    cells = data_set.lats.size
+    start = (START_DATE - data_set.start_date).total_seconds()
+    end_date = START_DATE.replace(year=START_DATE.year + 1)
+    data_set.set_window(START_DATE, end_date)
+    data_set.align(START_DATE, end_date)
+    for delta_t in DELTA_TS:
+        # One day, the chunk _get_E_tot integrates at a time
+        times = np.arange(start, start + 86400 + delta_t, delta_t)
+        add(
+            'get_data',
+            _time(lambda: data_set.sic.get_data(times)),
+            delta_t=delta_t, cells=cells, steps=times.size,
+        )
+        zeniths = data_set.get_zeniths(times)
+        thickness = data_set.sit.get_data(times)
+        temperature = data_set.tas.get_data(times)
+        add(
+            'get_albedos',
+            _time(lambda: albedos.table.get_albedos(
+                zeniths, thickness, temperature
+            )),
+            delta_t=delta_t, cells=cells, steps=times.size,
+        )
+        # Trapezoid weights over every step and cell, then the same day with
+        # the steps and cells where the sun is down skipped, as in a run
+        weights = np.full(times.size, float(delta_t))
+        weights[[0, -1]] /= 2
+        add(
+            'get_E_integral',
+            _time(lambda: _get_E_integral(times, weights, data_set,
+                                          albedos)),
+            delta_t=delta_t, cells=cells, steps=times.size,
+        )
+        add(
+            'get_lit_integral',
+            _time(lambda: _get_lit_integral(times, delta_t, data_set,
+                                            albedos, collections.Counter())),
+            delta_t=delta_t, cells=cells, steps=times.size,
+        )
+    for delta_t in YEAR_DELTA_TS:
+        add(
+            'year',
+            _time(lambda: get_radiative_forcing(
+                start_date=START_DATE,
+                delta_t=delta_t,
+                data_set=data_set,
+                albedos=albedos,
+                progress={'disable': True},
+            ), 1),
+            delta_t=delta_t, cells=cells,
+        )
+    data_set.close()
+
+
+def main(data_dir=DATA_DIR, out_path=OUT_PATH, resolutions=RESOLUTIONS,
+         imports=True):
+    results = []
+    if imports:
+        for stage, statement in (('import', IMPORTS),
+                                 ('import_numpy', 'import numpy')):
+            result = {'stage': stage, 'seconds': _time_import(statement)}
+            results.append(result)
+            print(json.dumps(result))
+    for name, resolution in resolutions.items():
+        directory = os.path.join(data_dir, name)
+        if os.path.isdir(directory):
+            paths = synthetic.get_paths(directory)
+        else:
+            print(f'writing {name} inputs')
+            paths = synthetic.write_data_set(directory, **resolution)
+        run_resolution(name, paths, results)
+    with open(out_path, 'w') as stream:
+        json.dump(
+            {'environment': _get_environment(), 'results': results},
+            stream,
+            indent=4,
+        )
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from stages import staged
+
+# Part of every day cache key; bump it whenever the code that integrates a
+# day changes its result
+DAY_CACHE_VERSION = 1
+
+
+class ArrayCache:
+
+    def __init__(self, max_bytes=2**30, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._disk_bytes = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._arrays = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        stats = ', '.join(f'{k}={v}' for k, v in self.stats.items())
+        return f'{self.__class__.__name__}({stats})'
+
+    def __contains__(self, key):
+        return key in self._arrays or (
+            self.directory is not None and os.path.exists(self._path(key))
+        )
+
+    def __len__(self):
+        return len(self._arrays)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        hit_rate = (self.hits + self.disk_hits) / lookups if lookups else 0.
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate,
+            'entries': len(self._arrays),
+            'nbytes': self._nbytes,
+        }
+
+    @staticmethod
+    def make_key(*parts):
+        sha = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part)
+                sha.update(str((part.dtype.str, part.shape)).encode())
+                sha.update(part.tobytes())
+            else:
+                sha.update(repr(part).encode())
+        return sha.hexdigest()
+
+    def get(self, key, compute):
+        array = self._arrays.get(key)
+        if array is not None:
+            self._arrays.move_to_end(key)
+            self.hits += 1
+            return array
+        if self.directory is not None:
+            try:
+                array = np.load(self._path(key), mmap_mode='r')
+                # Disk eviction goes by modification time, so hits refresh it
+                os.utime(self._path(key))
+            except OSError:
+                # Missing, or evicted by another process since
+                array = None
+            else:
+                self.disk_hits += 1
+        if array is None:
+            array = np.asarray(compute())
+            self.misses += 1
+            if self.directory is not None:
+                self._save(key, array)
+        array.flags.writeable = False
+        self._insert(key, array)
+        return array
+
+    def clear(self):
+        self._arrays.clear()
+        self._nbytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def _save(self, key, array):
+        # Write then rename so concurrent runs never read a partial table
+        tmp_path = f'{self._path(key)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as stream:
+            np.save(stream, array)
+        os.replace(tmp_path, self._path(key))
+        if self.max_disk_bytes is not None:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(
+                    size for *_, size in self._disk_files()
+                )
+            else:
+                self._disk_bytes += os.path.getsize(self._path(key))
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_files(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, path, stat.st_size
+
+    def _evict_disk(self):
+        # Least recently used files go first until the store fits again
+        files = sorted(self._disk_files())
+        self._disk_bytes = sum(size for *_, size in files)
+        for _, path, size in files:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_bytes -= size
+
+    def _insert(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+        self._arrays[key] = array
+        self._nbytes += array.nbytes
+        while self._nbytes > self.max_bytes:
+            _, evicted = self._arrays.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+
+class DayCache(ArrayCache):
+
+    @staged('cache.day')
+    def get_day(self, parts, date, chunk_size, delta_t, compute):
+        # Masks survive the round trip as NaN, which chunk integrals never
+        # hold otherwise
+        key = self.make_key('day', DAY_CACHE_VERSION, date.isoformat(),
+                            chunk_size, delta_t, *parts)
+        day = self.get(key, lambda: np.ma.filled(compute(), np.nan))
+        return np.ma.masked_invalid(day)
+
+
+class ZenithCache(ArrayCache):
+
+    @staticmethod
+    def time_of_year(dates):
+        # The fast solar altitude only depends on the day of year and the
+        # minute of the day, so tables are shared between years
+        dates = np.asarray(dates).astype('datetime64[m]').ravel()
+        days = dates.astype('datetime64[D]')
+        day_of_year = (days - days.astype('datetime64[Y]')).astype(int)
+        minute_of_day = (dates - days).astype(int)
+        return day_of_year, minute_of_day
+
+    def get_table(self, grid_key, dates, compute, kind='cos_zenith'):
+        day_of_year, minute_of_day = self.time_of_year(dates)
+        key = self.make_key(kind, grid_key, day_of_year, minute_of_day)
+        return self.get(key, compute)
@@ -0,0 +1,134 @@
+import json
+import os
+
+import numpy as np
+
+from cache import ArrayCache
+from data_set import DataSet
+
+# Part of every checkpoint key; bump it whenever the forcing a run produces
+# changes
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoint:
+
+    def __init__(self, directory, *parts, state_days=None, options=None):
+        # parts identify the inputs and parameters; any change starts a new
+        # checkpoint instead of resuming a different run. options are the
+        # integration options from get_options, which are also keyed on and
+        # checked against every run that uses the checkpoint.
+        self.key = ArrayCache.make_key('checkpoint', CHECKPOINT_VERSION,
+                                       *parts, options)
+        self.directory = os.path.join(directory, self.key)
+        self.state_days = state_days
+        self.options = options
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.directory!r}, ' \
+            f'state_days={self.state_days})'
+
+    @classmethod
+    def for_run(cls, directory, data_set_kwargs, albedos, delta_t,
+                method='trapz', tolerance=1e-3, skip_night=True,
+                scenarios=None, state_days=None):
+        # Keyed on every input and option that changes the forcing, with
+        # the same defaults as DataSet and get_radiative_forcing
+        input_key = DataSet.get_input_key(
+            paths=[
+                data_set_kwargs[name]
+                for name in ('sic_path', 'sit_path', 'tas_path', 'clt_path')
+            ],
+            params=(data_set_kwargs['sic_scale'],
+                    data_set_kwargs['clt_scale']),
+        )
+        return cls(
+            directory,
+            input_key,
+            data_set_kwargs.get('windowed', False),
+            data_set_kwargs.get('compact', False),
+            np.dtype(data_set_kwargs.get('dtype', np.float64)).str,
+            albedos.table.key,
+            state_days=state_days,
+            options=cls.get_options(delta_t, method, tolerance, skip_night,
+                                    scenarios),
+        )
+
+    @staticmethod
+    def get_options(delta_t, method, tolerance, skip_night, scenarios):
+        return {
+            'delta_t': delta_t,
+            'method': method,
+            'tolerance': tolerance,
+            'skip_night': skip_night,
+            'scenarios': scenarios and [
+                repr(scenario) for scenario in scenarios
+            ],
+        }
+
+    def check_options(self, delta_t, method, tolerance, skip_night,
+                      scenarios):
+        if self.options is None:
+            return
+        options = self.get_options(delta_t, method, tolerance, skip_night,
+                                   scenarios)
+        if options != self.options:
+            raise ValueError(
+                f'Checkpoint is for {self.options}, not {options}'
+            )
+
+    def _path(self, start_date, end_date, suffix):
+        return os.path.join(
+            self.directory,
+            f'{start_date:%Y%m%dT%H%M%S}-{end_date:%Y%m%dT%H%M%S}{suffix}'
+        )
+
+    def get_forcing(self, start_date, end_date):
+        path = self._path(start_date, end_date, '.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as stream:
+            return json.load(stream)['forcing']
+
+    def set_forcing(self, start_date, end_date, forcing):
+        path = self._path(start_date, end_date, '.json')
+        # Written to a temporary file first so an interrupted write never
+        # leaves a truncated checkpoint behind
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as stream:
+            json.dump(
+                {
+                    'start_date': start_date.isoformat(),
+                    'end_date': end_date.isoformat(),
+                    'forcing': forcing,
+                },
+                stream,
+                indent=4,
+            )
+        os.replace(tmp_path, path)
+        self.clear_state(start_date, end_date)
+
+    def get_state(self, start_date, end_date):
+        path = self._path(start_date, end_date, '.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            work = json.loads(str(state['work']))
+            return float(state['time']), state['E_integral'], work
+
+    def set_state(self, start_date, end_date, time, E_integral, work):
+        path = self._path(start_date, end_date, '.npz')
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(
+            tmp_path,
+            time=time,
+            E_integral=np.ma.getdata(E_integral),
+            work=json.dumps(work),
+        )
+        os.replace(tmp_path, path)
+
+    def clear_state(self, start_date, end_date):
+        path = self._path(start_date, end_date, '.npz')
+        if os.path.exists(path):
+            os.remove(path)
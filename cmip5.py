@@ -1,16 +1,40 @@
+import glob
+import json
 import os
 from contextlib import closing
 from datetime import datetime
 
-import netCDF4
 import numpy as np
-from scipy.interpolate import griddata, interp1d
+
+from interpolation import TimeInterpolator
+from stages import staged
+
+
+def get_nearest_indices(source_lats, source_lons, lats, lons):
+    from scipy.spatial import cKDTree
+
+    # Same nearest neighbours as griddata(method='nearest') in (lat, lon)
+    points = np.column_stack([source_lats.ravel(), source_lons.ravel()])
+    _, inds = cKDTree(points).query(
+        np.column_stack([lats.ravel(), lons.ravel()])
+    )
+    return inds.reshape(np.shape(lats))
 
 
 class CMIP5:
 
-    def __init__(self, filep, scale=1):
+    # Time slices written at once by save
+    save_slices = 64
+
+    @staged('cmip5.load')
+    def __init__(self, filep, scale=1, windowed=False):
+        # netCDF4 is imported where sources are read, so prepared inputs
+        # load without it
+        import netCDF4
+
         self._filep = filep
+        self._scale = scale
+        self.windowed = windowed
         if isinstance(filep, list):
             name = filep[0]
         else:
@@ -18,6 +42,12 @@ class CMIP5:
         key = os.path.basename(name).split('_')[0]
         if key.endswith('nc'):
             key = os.path.basename(name).split('.')[0]
+        self.key = key
+        self._regrid_inds = None
+        self._window = None
+        self._prefetch = None
+        self._mask = None
+        self._dtype = None
         with closing(netCDF4.MFDataset(filep)) as ds:
             lats = ds.variables['lat'][:]
             lons = ds.variables['lon'][:]
@@ -26,19 +56,21 @@ class CMIP5:
             if lats.ndim == 1:
                 lats = np.array(lats[arctic_mask])
                 self.lons, self.lats = np.meshgrid(lons, lats)
-                self.data = ds.variables[key][:][:, arctic_mask, ...]
             else:
                 arctic_mask = np.any(arctic_mask, axis=1)
                 self.lats = np.array(lats[arctic_mask, ...])
                 self.lons = np.array(lons[arctic_mask, ...])
-                self.data = ds.variables[key][:][:, arctic_mask, ...]
-            self.data = self.data * scale
-            self.data = np.ma.array(
-                self.data,
-                mask=np.ma.getmaskarray(self.data)
-            )
+            # Only the hyperslab of rows holding the Arctic is ever read
+            rows = np.flatnonzero(arctic_mask)
+            self._rows = slice(rows[0], rows[-1] + 1)
+            self._row_mask = arctic_mask[self._rows]
             ds_time = ds.variables['time']
-            self.dates = netCDF4.num2date(ds_time[:], ds_time.units)
+            # Python datetimes, as newer netCDF4 returns cftime objects
+            self.dates = netCDF4.num2date(
+                ds_time[:], ds_time.units,
+                only_use_cftime_datetimes=False,
+                only_use_python_datetimes=True,
+            )
             self.start_date = self.dates[0]
             self.end_date = self.dates[-1]
             self.times = np.array(
@@ -49,26 +81,168 @@ class CMIP5:
             )
             self.units = ds.variables[key].units
             self.long_name = ds.variables[key].long_name
-        self.key = key
-        self._interp_seconds = None
-        self._interp_mask = None
+            self.files = self._get_files()
+            self._file_ranges = None
+            if windowed:
+                self.data = None
+            else:
+                self.data = self._prepare(ds.variables[key][:, self._rows])
+        self._interpolator = None
         self._delta = None
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self._filep})'
 
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'metadata.json')) as stream:
+            metadata = json.load(stream)
+
+        def load_array(name):
+            return np.load(os.path.join(directory, f'{name}.npy'),
+                           mmap_mode='r')
+
+        cmip = cls.__new__(cls)
+        cmip._filep = metadata['filep']
+        cmip._scale = metadata['scale']
+        cmip.windowed = False
+        cmip.key = metadata['key']
+        cmip.units = metadata['units']
+        cmip.long_name = metadata['long_name']
+        cmip._regrid_inds = None
+        cmip._window = None
+        cmip._prefetch = None
+        cmip._mask = None
+        cmip._dtype = None
+        cmip._rows = None
+        cmip._row_mask = None
+        cmip.lats = np.array(load_array('lats'))
+        cmip.lons = np.array(load_array('lons'))
+        cmip.times = np.array(load_array('times'))
+        cmip.dates = load_array('dates').astype('datetime64[us]')
+        cmip.dates = cmip.dates.astype(datetime)
+        cmip.start_date = cmip.dates[0]
+        cmip.end_date = cmip.dates[-1]
+        cmip.files = metadata.get('files') or cmip._get_files()
+        cmip._file_ranges = metadata.get('file_ranges')
+        cmip.data = np.ma.array(load_array('data'), mask=load_array('mask'))
+        cmip._interpolator = None
+        cmip._delta = None
+        return cmip
+
+    def save(self, directory, cells=None, dtype=None):
+        # cells and dtype save a compacted copy of the fields. Fields are
+        # written a block of time slices at a time, so a memory-mapped
+        # record is never copied into memory whole.
+        os.makedirs(directory, exist_ok=True)
+        metadata = {
+            'filep': self._filep,
+            'scale': self._scale,
+            'key': self.key,
+            'units': self.units,
+            'long_name': self.long_name,
+            'files': self.files,
+            'file_ranges': self.file_ranges,
+        }
+        with open(os.path.join(directory, 'metadata.json'), 'w') as stream:
+            json.dump(metadata, stream, indent=4)
+        lats, lons = self.lats, self.lons
+        if cells is not None:
+            lats, lons = lats.ravel()[cells], lons.ravel()[cells]
+        arrays = {
+            'lats': lats,
+            'lons': lons,
+            'times': self.times,
+            'dates': np.array(
+                [np.datetime64(date, 's') for date in self.dates]
+            ),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(array))
+        fields = {
+            'data': (np.ma.getdata(self.data), dtype),
+            'mask': (np.ma.getmaskarray(self.data), None),
+        }
+        for name, (array, array_dtype) in fields.items():
+            if cells is not None:
+                array = array.reshape((array.shape[0], -1))
+                shape = (array.shape[0], cells.size)
+            else:
+                shape = array.shape
+            out = np.lib.format.open_memmap(
+                os.path.join(directory, f'{name}.npy'), mode='w+',
+                dtype=array_dtype or array.dtype, shape=shape,
+            )
+            for start in range(0, shape[0], self.save_slices):
+                block = array[start:start + self.save_slices]
+                out[start:start + self.save_slices] = \
+                    block if cells is None else block[:, cells]
+            out.flush()
+            del out
+
     @property
     def mask(self):
-        mask = np.ma.getmaskarray(self.data[0])
-        for data in self.data[1:]:
-            mask = mask & np.ma.getmaskarray(data)
-        return mask
+        if self._mask is None:
+            self._mask = np.ma.getmaskarray(self.data).all(axis=0)
+        return self._mask
+
+    @property
+    def window_times(self):
+        if self._window is None:
+            return self.times
+        return self.times[slice(*self._window)]
+
+    def _get_files(self):
+        # Same file order as MFDataset
+        if isinstance(self._filep, str):
+            names = sorted(glob.glob(self._filep))
+        else:
+            names = list(self._filep)
+        files = []
+        for name in names:
+            stat = os.stat(name)
+            files.append({
+                'path': os.path.abspath(name),
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+            })
+        return files
+
+    @property
+    def file_ranges(self):
+        # First and last time of each file, only read once a fingerprint
+        # needs them
+        if self._file_ranges is None:
+            import netCDF4
+
+            ranges = []
+            first = 0
+            for file in self.files:
+                with closing(netCDF4.Dataset(file['path'])) as ds:
+                    records = len(ds.dimensions['time'])
+                ranges.append((float(self.times[first]),
+                               float(self.times[first + records - 1])))
+                first += records
+            self._file_ranges = ranges
+        return self._file_ranges
+
+    def get_fingerprint(self, start, end):
+        # Identifies the files holding the samples a period interpolates
+        lo, hi = self.get_window(start, end)
+        lo_time, hi_time = self.times[lo], self.times[hi - 1]
+        return self._scale, tuple(
+            (file['path'], file['mtime_ns'], file['size'])
+            for file, (file_start, file_end) in zip(self.files,
+                                                    self.file_ranges)
+            if file_end >= lo_time and file_start <= hi_time
+        )
+
+    def get_source_time(self, time):
+        return time + self._delta
 
-    def get_data(self, time):
-        time = time + self._delta
-        data = self._interp_seconds(time)
-        mask = self._interp_mask(time)
-        return np.ma.array(data, mask=mask)
+    @staged('cmip5.interpolate')
+    def get_data(self, time, cells=None):
+        return self._interpolator(self.get_source_time(time), cells)
 
     def get_date(self, time):
         delta = np.timedelta64(int(self._delta), 's')
@@ -76,24 +250,53 @@ class CMIP5:
         date = (np.datetime64(self.start_date, 's') + delta + time)
         return date
 
+    def get_window(self, start, end):
+        start = start + self._delta
+        end = end + self._delta
+        # One extra slice either side so every query keeps its brackets
+        lo = np.searchsorted(self.times, start, side='right') - 2
+        hi = np.searchsorted(self.times, end, side='left') + 2
+        return max(int(lo), 0), min(int(hi), self.times.size)
+
+    def load_window(self, start, end, executor=None):
+        window = self.get_window(start, end)
+        if window == self._window:
+            return
+        if self._prefetch is not None and self._prefetch[0] == window:
+            data = self._prefetch[1].result()
+        elif executor is not None:
+            data = executor.submit(self._read, *window).result()
+        else:
+            data = self._read(*window)
+        self._prefetch = None
+        self.data = data
+        self._mask = None
+        self._window = window
+        self.set_interpolation()
+
+    def prefetch_window(self, start, end, executor):
+        if start + self._delta > self.times[-1]:
+            return
+        window = self.get_window(start, end)
+        if window == self._window:
+            return
+        self._prefetch = (window, executor.submit(self._read, *window))
+
     def set_interpolation(self):
-        self._interp_seconds = interp1d(
-            self.times,
-            self.data,
-            axis=0,
-            fill_value='extrapolate',
-        )
-        self._interp_mask = interp1d(
-            self.times,
-            np.ma.getmaskarray(self.data),
-            axis=0,
-            fill_value='extrapolate',
-        )
+        if self.data is None:
+            return
+        self._interpolator = TimeInterpolator(self.window_times, self.data)
 
     def set_delta(self, ref_date):
         self._delta = int((ref_date - self.start_date).total_seconds())
 
-    def set_grid_data(self, lats, lons):
+    def set_dtype(self, dtype):
+        self._dtype = np.dtype(dtype)
+        if self.data is not None and self.data.dtype != self._dtype:
+            self.data = self.data.astype(self._dtype)
+
+    @staged('cmip5.regrid')
+    def set_grid_data(self, lats, lons, cache=None):
         same_lats = np.array_equal(lats, self.lats)
         same_lons = np.array_equal(lons, self.lons)
         if same_lats and same_lons:
@@ -101,28 +304,68 @@ class CMIP5:
         lats = lats.copy()
         lons = lons.copy()
 
-        datas = []
-        points = self.lats.copy().flatten(), self.lons.copy().flatten()
-        for datain in self.data:
-            data = griddata(
-                points=points,
-                values=datain.flatten(),
-                xi=(lats, lons),
-                method='nearest'
-            )
-            datas.append(data)
-        self.data = np.ma.vstack(
-            [np.ma.expand_dims(d, axis=0) for d in datas]
-        )
+        def compute():
+            return get_nearest_indices(self.lats, self.lons, lats, lons)
 
+        if cache is None:
+            self._regrid_inds = compute()
+        else:
+            key = cache.make_key('nearest', self.lats, self.lons, lats, lons)
+            self._regrid_inds = cache.get(key, compute)
         self.lons = lons
         self.lats = lats
+        if self.data is not None:
+            self.data = self._regrid(self.data)
+            self._mask = None
+
+    def compact(self, cells):
+        # Keep only the given flat cells of the current grid; later reads
+        # gather them straight from the source grid
+        if self._regrid_inds is None:
+            self._regrid_inds = cells
+        else:
+            self._regrid_inds = self._regrid_inds.ravel()[cells]
+        self.lats = self.lats.ravel()[cells]
+        self.lons = self.lons.ravel()[cells]
+        if self.data is not None:
+            data = self.data.reshape((self.data.shape[0], -1))
+            self.data = data[:, cells]
+            self._mask = None
+
+    @staged('cmip5.read')
+    def _read(self, start, stop):
+        import netCDF4
+
+        with closing(netCDF4.MFDataset(self._filep)) as ds:
+            data = ds.variables[self.key][start:stop, self._rows]
+        return self._prepare(data)
+
+    def _prepare(self, data):
+        if not self._row_mask.all():
+            data = data[:, self._row_mask, ...]
+        if self._scale != 1:
+            if np.issubdtype(data.dtype, np.floating):
+                data *= self._scale
+            else:
+                data = data * self._scale
+        data = np.ma.array(data, mask=np.ma.getmaskarray(data))
+        if self._regrid_inds is not None:
+            data = self._regrid(data)
+        if self._dtype is not None and data.dtype != self._dtype:
+            data = data.astype(self._dtype)
+        return data
+
+    def _regrid(self, data):
+        data = data.reshape((data.shape[0], -1))
+        return data[:, self._regrid_inds]
 
 
 class CltCMIP5(CMIP5):
 
     leap_years = np.arange(1972, 3000, 4).astype('str').astype('datetime64[Y]')
+    cycle_seconds = (365 * 3 + 366) * 24 * 60 * 60
 
+    @staged('cmip5.climatology')
     def __init__(self, filep, scale=1):
         super().__init__(filep, scale)
         dates = []
@@ -165,51 +408,32 @@ class CltCMIP5(CMIP5):
         ref_leap_year = ref_date.year - int(np.abs(diff[diff < 0]).min())
         ref_leap_year = np.datetime64(str(ref_leap_year), 's')
         self._ref_leap_year = ref_leap_year
+        # Seconds from the reference leap year to the data set start, so a
+        # query folds into the climatology with a single modulo
+        self._offset = int(
+            (self._delta - ref_leap_year).astype('timedelta64[s]').astype(int)
+        )
 
-    def _fix_future_time(self, time):
-        if np.all(time <= self.times[-1]):
-            return time
-        four_years = np.timedelta64(365 * 3 + 366, 'D')
-        mask = time > self.times[-1]
-        time_to_change = time[mask]
-        dates = self._ref_leap_year + time_to_change.astype('timedelta64[s]')
-        new_dates = dates - four_years.astype('timedelta64[s]')
-        new_time = (new_dates - self._ref_leap_year).astype('timedelta64[s]')
-        new_time = new_time.astype(int)
-        time[mask] = self._fix_future_time(new_time)
-        return time
-
-    def _fix_past_time(self, time):
-        if np.all(time >= self.times[0]):
-            return time
-        four_years = np.timedelta64(365 * 3 + 366, 'D')
-        mask = time < self.times[0]
-        time_to_change = time[mask]
-        dates = self._ref_leap_year + time_to_change.astype('timedelta64[s]')
-        new_dates = dates + four_years.astype('timedelta64[s]')
-        new_time = (new_dates - self._ref_leap_year).astype('timedelta64[s]')
-        new_time = new_time.astype(int)
-        time[mask] = self._fix_past_time(new_time)
-        return time
-
-    def get_data(self, time):
-        time = time.astype('timedelta64[s]')
-        dates = self._delta + time
-        time = (dates - self._ref_leap_year).astype('timedelta64[s]')
-        time = time.astype(int)
-        time = self._fix_future_time(time)
-        time = self._fix_past_time(time)
-        data = self._interp_seconds(time)
-        mask = self._interp_mask(time)
-        return np.ma.array(data, mask=mask)
+    @property
+    def file_ranges(self):
+        # The fingerprint covers every file, so no ranges are needed
+        return None
+
+    def get_fingerprint(self, start, end):
+        # Every day of the climatology averages all of the files
+        return self._scale, tuple(
+            (file['path'], file['mtime_ns'], file['size'])
+            for file in self.files
+        )
+
+    def get_source_time(self, time):
+        # Every leap cycle starts on 1 Jan of a leap year, so shifting a
+        # whole number of cycles keeps the day of year and time of day
+        time = np.asarray(time).astype('timedelta64[s]').astype(np.int64)
+        return np.mod(time + self._offset, self.cycle_seconds)
 
     def get_date(self, time):
-        time = time.astype('timedelta64[s]')
-        dates = self._delta + time
-        time = (dates - self._ref_leap_year).astype('timedelta64[s]')
-        time = time.astype(int)
-        time = self._fix_future_time(time)
-        time = self._fix_past_time(time)
+        time = self.get_source_time(time)
         dates = np.datetime64(self.start_date) + time.astype('timedelta64[s]')
         dates = dates.astype(datetime)
         return dates
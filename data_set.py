@@ -1,57 +1,308 @@
-from datetime import timedelta
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-import pysolar
 import numpy as np
 
+from cache import ArrayCache, ZenithCache
 from cmip5 import CMIP5, CltCMIP5
+from solar_position import SolarPosition
+from stages import staged
+
+# Part of every input cache key; bump it whenever what is stored changes
+INPUT_CACHE_VERSION = 1
 
 
 class DataSet:
 
+    @staged('data_set.load')
     def __init__(self, sic_path, sit_path, tas_path, clt_path, sic_scale,
-                 clt_scale):
-        print('loading data')
-        self.sic = CMIP5(sic_path, sic_scale)
-        self.sit = CMIP5(sit_path)
-        self.tas = CMIP5(tas_path)
-        self.clt = CltCMIP5(clt_path, clt_scale)
+                 clt_scale, zenith_cache=None, windowed=False,
+                 regrid_cache=None, input_cache=None, compact=False,
+                 dtype=np.float64, debug=False):
+        if compact and windowed:
+            raise ValueError('Compact data sets need the full record loaded')
+        # Fields, zeniths and albedos use dtype; integrals stay in float64.
+        # Prepared inputs are stored in dtype, so they are memory-mapped
+        # without a converted copy.
+        self.dtype = np.dtype(dtype)
+        prepared_dir = None
+        if input_cache is not None and not windowed:
+            key = self.get_input_key(
+                paths=(sic_path, sit_path, tas_path, clt_path),
+                params=(sic_scale, clt_scale, self.dtype.str),
+            )
+            prepared_dir = os.path.join(input_cache, key)
+
+        if prepared_dir is not None and os.path.isdir(prepared_dir):
+            print('loading prepared data')
+            self._load_prepared(prepared_dir)
+        else:
+            print('loading data')
+            self.sic = CMIP5(sic_path, sic_scale, windowed=windowed)
+            self.sit = CMIP5(sit_path, windowed=windowed)
+            self.tas = CMIP5(tas_path, windowed=windowed)
+            self.clt = self._get_climatology(clt_path, clt_scale,
+                                             input_cache)
+
+            model_cmips = (self.sic, self.sit, self.tas)
+            self.start_date = max([cmip.start_date for cmip in model_cmips])
+
+            model_cmips = (self.sic, self.sit, self.tas, self.clt)
+
+            lowest_res = min(model_cmips, key=lambda cmip: cmip.lats.size)
+            self.lats = lowest_res.lats.copy()
+            self.lons = lowest_res.lons.copy()
+            print('Setting Uniform Grid')
+            for cmip in model_cmips:
+                cmip.set_grid_data(self.lats, self.lons, regrid_cache)
 
-        model_cmips = (self.sic, self.sit, self.tas)
+            if prepared_dir is not None:
+                for cmip in model_cmips:
+                    cmip.set_dtype(self.dtype)
+                self._save_atomic(prepared_dir, self._save_prepared)
 
-        self.start_date = max([cmip.start_date for cmip in model_cmips])
         self.start_date_np = np.datetime64(
             self.start_date.replace(tzinfo=None)
         )
-        for cmip in model_cmips:
+
+        self.areas = self._get_areas()
+        self.grid_shape = self.lats.shape
+        self.grid_lats = self.lats
+        self.grid_lons = self.lons
+        self.cells = None
+        if compact:
+            self._compact(prepared_dir)
+
+        for cmip in (self.sic, self.sit, self.tas, self.clt):
             cmip.set_delta(self.start_date)
+            cmip.set_dtype(self.dtype)
+            cmip.set_interpolation()
 
-        self.clt.set_delta(self.start_date)
+        self.solar = SolarPosition(self.lats, self.lons, self.dtype)
+        self.zenith_cache = zenith_cache
+        self._grid_key = ZenithCache.make_key(
+            self.lats, self.lons, self.solar.dtype.str
+        )
 
-        model_cmips = (self.sic, self.sit, self.tas, self.clt)
+        # Every chunk is checked against the sources' dates when debugging,
+        # otherwise only against the alignment verified for its year
+        self.debug = debug
+        self.alignment = None
 
-        lowest_res = min(model_cmips, key=lambda cmip: cmip.lats.size)
-        self.lats, self.lons = lowest_res.lats.copy(), lowest_res.lons.copy()
-        print('Setting Uniform Grid')
-        for cmip in model_cmips:
-            cmip.set_grid_data(self.lats, self.lons)
+        self.windowed = windowed
+        # A single reader thread keeps netCDF access serialized while the
+        # next window is read in the background
+        self._executor = ThreadPoolExecutor(max_workers=1) \
+            if windowed else None
 
-        for cmip in model_cmips:
-            cmip.set_interpolation()
+    def _compact(self, prepared_dir=None):
+        # Cells that are land (or never have ice data) for the whole record
+        # add nothing to the forcing, so every field keeps only the rest.
+        # With an input cache the compacted fields are stored next to the
+        # prepared ones and memory-mapped from there.
+        if prepared_dir is None:
+            self.cells = self._get_active_cells()
+            for cmip in (self.sic, self.sit, self.tas, self.clt):
+                cmip.compact(self.cells)
+        else:
+            cells_path = os.path.join(prepared_dir, 'cells.npy')
+            if os.path.exists(cells_path):
+                self.cells = np.load(cells_path)
+            else:
+                self.cells = self._get_active_cells()
+                tmp_path = f'{cells_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as stream:
+                    np.save(stream, self.cells)
+                os.replace(tmp_path, cells_path)
+            key = ArrayCache.make_key('compact', self.cells, self.dtype.str)
+            directory = os.path.join(prepared_dir, f'compact_{key}')
+            if not os.path.isdir(directory):
+                self._save_atomic(directory, lambda path: self._save_cmips(
+                    path, self.cells, self.dtype
+                ))
+            self._load_cmips(directory)
+        self.lats = self.lats.ravel()[self.cells]
+        self.lons = self.lons.ravel()[self.cells]
+        self.areas = self.areas.ravel()[self.cells]
+        print(f'Compact grid: {self.cells.size} of '
+              f'{int(np.prod(self.grid_shape))} cells active')
 
-        self.areas = self._get_areas()
+    def _get_active_cells(self):
+        return np.flatnonzero(~(self.sic.mask | self.sit.mask))
 
-    def get_zeniths(self, times):
+    def unpack(self, values):
+        if self.cells is None:
+            return values
+        values = np.ma.getdata(values)
+        shape = values.shape[:-1] + (int(np.prod(self.grid_shape)),)
+        full = np.ma.masked_all(shape, dtype=values.dtype)
+        full[..., self.cells] = values
+        return full.reshape(values.shape[:-1] + self.grid_shape)
+
+    @staticmethod
+    def get_input_key(paths, params):
+        files = []
+        for path in paths:
+            if isinstance(path, str):
+                names = sorted(glob.glob(path))
+            else:
+                names = list(path)
+            for name in names:
+                stat = os.stat(name)
+                files.append(
+                    (os.path.abspath(name), stat.st_mtime_ns, stat.st_size)
+                )
+        return ArrayCache.make_key('prepared', INPUT_CACHE_VERSION, files,
+                                   params)
+
+    @classmethod
+    def _get_climatology(cls, clt_path, clt_scale, input_cache=None):
+        # Every model run shares the cloud climatology, so it is kept
+        # unregridded in input_cache and only averaged once
+        if input_cache is None:
+            return CltCMIP5(clt_path, clt_scale)
+        key = cls.get_input_key(paths=(clt_path,), params=('clt', clt_scale))
+        directory = os.path.join(input_cache, 'climatology', key)
+        if os.path.isdir(directory):
+            return CltCMIP5.load(directory)
+        clt = CltCMIP5(clt_path, clt_scale)
+        cls._save_atomic(directory, clt.save)
+        return clt
+
+    @staticmethod
+    def _save_atomic(directory, save):
+        # save(path) writes next to the final directory, which is then
+        # renamed into place so other processes never open a partially
+        # written cache
+        tmp_dir = f'{directory}.{os.getpid()}.tmp'
+        save(tmp_dir)
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            shutil.rmtree(tmp_dir)
+
+    def _load_cmips(self, directory):
+        self.sic = CMIP5.load(os.path.join(directory, 'sic'))
+        self.sit = CMIP5.load(os.path.join(directory, 'sit'))
+        self.tas = CMIP5.load(os.path.join(directory, 'tas'))
+        self.clt = CltCMIP5.load(os.path.join(directory, 'clt'))
+
+    def _save_cmips(self, directory, cells=None, dtype=None):
+        for name in ('sic', 'sit', 'tas', 'clt'):
+            getattr(self, name).save(os.path.join(directory, name), cells,
+                                     dtype)
+
+    def _load_prepared(self, directory):
+        self._load_cmips(directory)
+        with open(os.path.join(directory, 'data_set.json')) as stream:
+            metadata = json.load(stream)
+        self.start_date = datetime.fromisoformat(metadata['start_date'])
+        self.lats = np.load(os.path.join(directory, 'lats.npy'))
+        self.lons = np.load(os.path.join(directory, 'lons.npy'))
+
+    def _save_prepared(self, directory):
+        self._save_cmips(directory)
+        metadata = {
+            'start_date': self.start_date.replace(tzinfo=None).isoformat(),
+        }
+        with open(os.path.join(directory, 'data_set.json'), 'w') as stream:
+            json.dump(metadata, stream, indent=4)
+        np.save(os.path.join(directory, 'lats.npy'), np.asarray(self.lats))
+        np.save(os.path.join(directory, 'lons.npy'), np.asarray(self.lons))
+
+    @property
+    def windowed_cmips(self):
+        return tuple(
+            cmip for cmip in (self.sic, self.sit, self.tas, self.clt)
+            if cmip.windowed
+        )
+
+    @staged('data_set.window')
+    def set_window(self, start_date, end_date, next_window=None):
+        if not self.windowed:
+            return
+        start = (start_date - self.start_date).total_seconds()
+        end = (end_date - self.start_date).total_seconds()
+        for cmip in self.windowed_cmips:
+            cmip.load_window(start, end, self._executor)
+        if next_window is None:
+            return
+        next_start, next_end = next_window
+        next_start = (next_start - self.start_date).total_seconds()
+        next_end = (next_end - self.start_date).total_seconds()
+        for cmip in self.windowed_cmips:
+            cmip.prefetch_window(next_start, next_end, self._executor)
+
+    @staged('data_set.align')
+    def align(self, start_date, end_date):
+        start = (start_date - self.start_date).total_seconds()
+        end = (end_date - self.start_date).total_seconds()
+        times = np.arange(start, end + 1, 60 * 60)
+        self.check_alignment(times)
+        self.alignment = {'start': start, 'end': end}
+        return self.alignment
+
+    def check_alignment(self, times):
+        sic_dates = self.sic.get_date(times)
+        for cmip in (self.sit, self.tas):
+            assert np.array_equal(sic_dates, cmip.get_date(times))
+        # The cloud climatology repeats, so only the calendar position of its
+        # dates has to match
+        clt_dates = self.clt.get_date(times).astype('datetime64[s]')
+        for sic_part, clt_part in zip(self._get_calendar(sic_dates),
+                                      self._get_calendar(clt_dates)):
+            assert np.array_equal(sic_part, clt_part)
+
+    @staticmethod
+    def _get_calendar(dates):
+        months = dates.astype('datetime64[M]')
+        month_of_year = months - dates.astype('datetime64[Y]')
+        return month_of_year, dates - months
+
+    def get_fingerprint(self, start, end):
+        return tuple(
+            cmip.get_fingerprint(start, end)
+            for cmip in (self.sic, self.sit, self.tas, self.clt)
+        )
+
+    @staged('data_set.check_times')
+    def check_times(self, times):
+        assert self.alignment is not None
+        assert self.alignment['start'] <= np.min(times)
+        assert np.max(times) <= self.alignment['end']
+        if self.debug:
+            self.check_alignment(times)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staged('data_set.zeniths')
+    def get_cos_zeniths(self, times, cache=True, cells=None):
         times = times.astype('timedelta64[s]')
         dates = self.start_date_np + times
-        dates = dates.reshape((dates.size, 1, 1))
-        altitude = pysolar.solar.get_altitude_fast(self.lats, self.lons, dates)
-        zenith = 90 - altitude
-        return zenith
+        if self.zenith_cache is None or not cache:
+            return self.solar.get_cos_zeniths(dates, cells)
+        grid_key = self._grid_key
+        if cells is not None:
+            # Tiles are cached on their own, without a full grid table
+            grid_key = ZenithCache.make_key(grid_key, cells)
+        return self.zenith_cache.get_table(
+            grid_key=grid_key,
+            dates=dates,
+            compute=lambda: self.solar.get_cos_zeniths(dates, cells),
+        )
+
+    def get_zeniths(self, times):
+        return self.solar.cos_to_zeniths(self.get_cos_zeniths(times))
 
     def get_zeniths_scalar(self, time):
         date = self.start_date + timedelta(seconds=time)
-        altitude = pysolar.solar.get_altitude_fast(self.lats, self.lons, date)
-        zenith = 90 - altitude
+        zenith = self.solar.get_zeniths(np.datetime64(date))[0]
         return zenith
 
     @staticmethod
@@ -0,0 +1,97 @@
+import json
+import sys
+from datetime import datetime
+
+import numpy as np
+
+import runner
+
+# Runs every model, experiment and realization listed in a manifest and
+# writes their forcings to one file. The manifest holds "defaults" that every
+# run starts from and a list of "runs". Paths may use {model}, {experiment}
+# and {realization}; see ensemble.json.
+MANIFEST_PATH = 'ensemble.json'
+
+PATH_KEYS = ('sic_path', 'sit_path', 'tas_path', 'clt_path')
+
+
+def load_manifest(path):
+    with open(path) as stream:
+        manifest = json.load(stream)
+    runs = {}
+    for run in manifest['runs']:
+        run = {**manifest.get('defaults', {}), **run}
+        for key in PATH_KEYS:
+            run[key] = run[key].format(**run)
+        name = run.get('name') or '_'.join(
+            run[key] for key in ('model', 'experiment', 'realization')
+        )
+        if name in runs:
+            raise ValueError(f'Run {name!r} is listed more than once')
+        run['name'] = name
+        runs[name] = run
+    return manifest, runs
+
+
+def get_start_dates(run):
+    return runner.get_start_dates(
+        datetime.fromisoformat(run['begin_date']), run['num_years']
+    )
+
+
+def write_results(path, runs, options, forcings):
+    out = {'options': options, 'runs': {}, 'experiments': {}}
+    for name, run in runs.items():
+        run_forcings = forcings.get(name, {})
+        values = list(run_forcings.values())
+        out['runs'][name] = {
+            key: run.get(key)
+            for key in ('model', 'experiment', 'realization')
+        }
+        out['runs'][name]['forcing'] = {
+            date.isoformat(): forcing for date, forcing
+            in sorted(run_forcings.items())
+        }
+        out['runs'][name]['mean'] = np.mean(values) if values else None
+        out['runs'][name]['std'] = np.std(values) if values else None
+    # Each run counts once towards its experiment's ensemble mean
+    means = {}
+    for name, run in runs.items():
+        if out['runs'][name]['mean'] is not None:
+            means.setdefault(run.get('experiment'), []).append(
+                out['runs'][name]['mean']
+            )
+    for experiment, values in means.items():
+        out['experiments'][experiment] = {
+            'runs': len(values),
+            'mean': np.mean(values),
+            'std': np.std(values),
+        }
+    with open(path, 'w') as stream:
+        json.dump(out, stream, indent=4)
+
+
+if __name__ == '__main__':
+    manifest, runs = load_manifest(
+        sys.argv[1] if len(sys.argv) > 1 else MANIFEST_PATH
+    )
+    options = {
+        'delta_t': manifest.get('delta_t', runner.DELTA_T),
+        'method': manifest.get('method', runner.METHOD),
+        'tolerance': manifest.get('tolerance', runner.TOLERANCE),
+    }
+    out_path = manifest.get(
+        'out_path', f"ensemble_delta_t_{options['delta_t']}.json"
+    )
+    forcings = {}
+    run_forcings = runner.iter_forcings(
+        {
+            name: ({key: run[key] for key in PATH_KEYS}, get_start_dates(run))
+            for name, run in runs.items()
+        },
+        **options,
+    )
+    for name, start_date, forcing in run_forcings:
+        print(name, start_date, forcing)
+        forcings.setdefault(name, {})[start_date] = forcing
+        write_results(out_path, runs, options, forcings)
@@ -0,0 +1,149 @@
+import os
+from datetime import timedelta
+
+import numpy as np
+
+
+class ForcingFields:
+
+    def __init__(self, directory=None, complevel=4):
+        # Built up from the daily chunk integrals of one period; with a
+        # directory every finished period is also written to netCDF there
+        self.directory = directory
+        self.complevel = complevel
+        self.start_date = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.directory!r})'
+
+    def start(self, data_set, start_date, end_date, scenarios, S):
+        self.data_set = data_set
+        self.start_date = start_date
+        self.end_date = end_date
+        self.scenarios = [scenario.name for scenario in scenarios]
+        self.S = S
+        self.forcing = None
+        cells = data_set.lats.size
+        # Days go to the month they start in
+        last_date = end_date - timedelta(microseconds=1)
+        self.months = []
+        year, month = start_date.year, start_date.month
+        while (year, month) <= (last_date.year, last_date.month):
+            self.months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        self.energy = np.zeros((len(scenarios), cells))
+        self.monthly_energy = np.zeros((len(scenarios), len(self.months),
+                                        cells))
+        self.days = []
+        self.daily_forcing = []
+        # W m^-2 of global forcing per unit of cell energy integral over a
+        # second, in float64 as areas follow the precision of the lats
+        areas = np.ma.array(data_set.areas, mask=data_set.sic.mask)
+        self._weights = (
+            S * areas.filled(0).ravel().astype(np.float64) /
+            data_set.lat_lon_area(-90, 90, 0, 360)
+        )
+
+    def add(self, date, chunk_size, chunk_integral):
+        chunk_integral = np.ma.filled(chunk_integral, 0).reshape(
+            (len(self.scenarios), -1)
+        )
+        energy = self.S * chunk_integral
+        self.energy += energy
+        month = self.months.index((date.year, date.month))
+        self.monthly_energy[:, month] += energy
+        self.days.append(date)
+        self.daily_forcing.append(
+            chunk_integral @ self._weights / chunk_size
+        )
+
+    def finish(self, forcing):
+        if isinstance(forcing, dict):
+            forcing = [forcing[name] for name in self.scenarios]
+        self.forcing = np.atleast_1d(forcing)
+        if self.directory is not None:
+            self.write(os.path.join(
+                self.directory,
+                f'fields_{self.start_date:%Y%m%dT%H%M%S}-'
+                f'{self.end_date:%Y%m%dT%H%M%S}.nc'
+            ))
+
+    def get_month_start(self, year, month):
+        date = self.start_date.replace(year=year, month=month, day=1, hour=0,
+                                       minute=0, second=0, microsecond=0)
+        return max(date, self.start_date)
+
+    def get_maps(self, values):
+        # Cells outside the forcing mask are masked in the maps
+        values = values.reshape(values.shape[:-1] + self.data_set.lats.shape)
+        mask = np.broadcast_to(self.data_set.sic.mask, values.shape)
+        maps = self.data_set.unpack(np.ma.array(values, mask=mask))
+        return np.ma.array(np.ma.filled(maps, 0), mask=np.ma.getmask(maps))
+
+    def write(self, path):
+        import netCDF4
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        units = f'seconds since {self.start_date:%Y-%m-%d %H:%M:%S}'
+        compression = {'zlib': True, 'complevel': self.complevel}
+        with netCDF4.Dataset(tmp_path, 'w', format='NETCDF4') as ds:
+            ds.start_date = self.start_date.isoformat()
+            ds.end_date = self.end_date.isoformat()
+            ds.solar_constant = self.S
+            ds.createDimension('scenario', len(self.scenarios))
+            ds.createDimension('month', len(self.months))
+            ds.createDimension('day', len(self.days))
+            ds.createDimension('y', self.data_set.grid_shape[0])
+            ds.createDimension('x', self.data_set.grid_shape[1])
+            scenario = ds.createVariable('scenario', str, ('scenario',))
+            for i, name in enumerate(self.scenarios):
+                scenario[i] = name
+            for name, units_name, values in (
+                ('lat', 'degrees_north', self.data_set.grid_lats),
+                ('lon', 'degrees_east', self.data_set.grid_lons),
+            ):
+                variable = ds.createVariable(name, 'f8', ('y', 'x'))
+                variable.units = units_name
+                variable[:] = values
+            month = ds.createVariable('month', 'f8', ('month',))
+            month.units = units
+            month[:] = [
+                (self.get_month_start(year, month) -
+                 self.start_date).total_seconds()
+                for year, month in self.months
+            ]
+            day = ds.createVariable('day', 'f8', ('day',))
+            day.units = units
+            day[:] = [
+                (date - self.start_date).total_seconds()
+                for date in self.days
+            ]
+
+            forcing = ds.createVariable('forcing', 'f8', ('scenario',))
+            forcing.units = 'W m-2'
+            forcing.long_name = 'global annual radiative forcing'
+            if self.forcing is not None:
+                forcing[:] = self.forcing
+            daily = ds.createVariable('daily_forcing', 'f8',
+                                      ('scenario', 'day'), **compression)
+            daily.units = 'W m-2'
+            daily.long_name = 'global forcing of the absorbed energy each day'
+            daily[:] = np.array(self.daily_forcing).T
+            energy = ds.createVariable(
+                'energy', 'f4', ('scenario', 'y', 'x'),
+                fill_value=np.float32(1e20), **compression,
+            )
+            energy.units = 'J m-2'
+            energy.long_name = 'absorbed shortwave energy over the period'
+            energy[:] = self.get_maps(self.energy)
+            monthly = ds.createVariable(
+                'monthly_energy', 'f4', ('scenario', 'month', 'y', 'x'),
+                fill_value=np.float32(1e20),
+                chunksizes=(1, 1) + self.data_set.grid_shape, **compression,
+            )
+            monthly.units = 'J m-2'
+            monthly.long_name = 'absorbed shortwave energy per month'
+            monthly[:] = self.get_maps(self.monthly_energy)
+        os.replace(tmp_path, path)
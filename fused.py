@@ -0,0 +1,76 @@
+import numpy as np
+
+from stages import staged
+
+BLOCK_SIZE = 2 ** 18  # Elements per block of steps x cells
+
+
+def _accumulate_numpy(out, weights, cos_zeniths, ice, cloud, a_Ocld,
+                      a_Oclr, a_Icld, a_Iclr, valid):
+    # E = cos(z) (sea + ice (ice_sky - sea_sky)), with each sky mixing the
+    # clear and cloudy albedos by cloud fraction. Everything is written
+    # into the albedo buffers, which the table hands out for reuse, and
+    # into the per-scenario ice fractions along the batch axis of ice.
+    ice_sky = np.subtract(a_Iclr, a_Icld, out=a_Icld)
+    ice_sky *= cloud
+    np.subtract(1, a_Iclr, out=a_Iclr)
+    ice_sky += a_Iclr
+    sea_sky = np.subtract(a_Oclr, a_Ocld, out=a_Ocld)
+    sea_sky *= cloud
+    np.subtract(1, a_Oclr, out=a_Oclr)
+    sea_sky += a_Oclr
+    ice_sky -= sea_sky
+    for sky in (ice_sky, sea_sky):
+        sky *= cos_zeniths
+        sky *= valid
+    # Steps within a block sum in the field precision, blocks in out's
+    weights = weights.astype(ice_sky.dtype)
+    out += weights @ sea_sky
+    for scenario_ice, scenario_out in zip(ice, out):
+        scenario_ice *= ice_sky
+        scenario_out += weights @ scenario_ice
+
+
+def _accumulate_loops(out, weights, cos_zeniths, ice, cloud, a_Ocld, a_Oclr,
+                      a_Icld, a_Iclr, valid):
+    for t in range(cos_zeniths.shape[0]):
+        weight = weights[t]
+        for j in range(cos_zeniths.shape[1]):
+            if not valid[t, j]:
+                continue
+            c = cloud[t, j]
+            ice_sky = 1 - a_Iclr[t, j] + c * (a_Iclr[t, j] - a_Icld[t, j])
+            sea_sky = 1 - a_Oclr[t, j] + c * (a_Oclr[t, j] - a_Ocld[t, j])
+            insolation = weight * cos_zeniths[t, j]
+            for b in range(ice.shape[0]):
+                E = sea_sky + ice[b, t, j] * (ice_sky - sea_sky)
+                out[b, j] += insolation * E
+
+
+_accumulate = None
+
+
+def _get_accumulate():
+    # numba takes longer to import than the rest of the model, so it is
+    # loaded and the loops compiled on the first block rather than at import
+    global _accumulate
+    if _accumulate is None:
+        try:
+            import numba
+        except ImportError:
+            _accumulate = _accumulate_numpy
+        else:
+            _accumulate = numba.njit(cache=True, nogil=True)(
+                _accumulate_loops
+            )
+    return _accumulate
+
+
+@staged('fused.accumulate')
+def accumulate_E(out, weights, cos_zeniths, ice, cloud, albedos, valid):
+    # out is (scenarios, cells) and ice (scenarios, steps, cells); ice and
+    # the albedo buffers are used as scratch space
+    a_Ocld, a_Oclr, a_Icld, a_Iclr = albedos
+    accumulate = _get_accumulate()
+    accumulate(out, weights, cos_zeniths, ice, cloud, a_Ocld, a_Oclr,
+               a_Icld, a_Iclr, valid)
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class TimeInterpolator:
+
+    def __init__(self, times, data):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.data = np.ma.getdata(data)
+        mask = np.ma.getmaskarray(data)
+        if np.array_equal(mask.all(axis=0), mask.any(axis=0)):
+            self._mask = mask[0].copy()
+            self._masks = None
+        else:
+            self._mask = None
+            self._masks = mask
+        steps = np.diff(self.times)
+        if steps.size and np.allclose(steps, steps[0], rtol=0, atol=1e-6):
+            self._step = steps[0]
+        else:
+            self._step = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(times={self.times.size}, ' \
+            f'uniform={self._step is not None})'
+
+    @property
+    def static_mask(self):
+        return self._mask is not None
+
+    def get_brackets(self, times):
+        if self._step is not None:
+            inds = np.floor((times - self.times[0]) / self._step)
+            inds = inds.astype(int)
+        else:
+            inds = np.searchsorted(self.times, times, side='right') - 1
+        # Out of range times extrapolate from the first/last interval
+        return np.clip(inds, 0, self.times.size - 2)
+
+    def __call__(self, times, cells=None):
+        times = np.asarray(times, dtype=np.float64)
+        if np.any(np.diff(times) < 0):
+            order = np.argsort(times, kind='stable')
+            data = self(times[order], cells)
+            unsorted = np.ma.empty_like(data)
+            unsorted[order] = data
+            return unsorted
+        inds = self.get_brackets(times)
+        # cells selects flat cells of the grid, so tiles only read their own
+        # part of each slice
+        data, static_mask, masks = self.data, self._mask, self._masks
+        if cells is not None:
+            data = data.reshape((data.shape[0], -1))
+            if static_mask is not None:
+                static_mask = static_mask.ravel()[cells]
+            else:
+                masks = masks.reshape(data.shape)
+
+        def row(array, ind):
+            return array[ind] if cells is None else array[ind][cells]
+
+        grid_shape = row(data, 0).shape
+        out = np.empty(times.shape + grid_shape, dtype=self.data.dtype)
+        if static_mask is not None and not static_mask.any():
+            mask = np.ma.nomask
+        elif static_mask is not None:
+            mask = np.broadcast_to(static_mask, out.shape).copy()
+        else:
+            mask = np.empty(out.shape, dtype=bool)
+        # Sorted times put each bracket on a run of consecutive rows, so only
+        # its two neighbouring slices are read
+        bounds = np.flatnonzero(np.diff(inds)) + 1
+        for start, stop in zip(np.r_[0, bounds], np.r_[bounds, times.size]):
+            ind = inds[start]
+            x_lo, x_hi = self.times[ind], self.times[ind + 1]
+            y_lo, y_hi = row(data, ind), row(data, ind + 1)
+            slope = (y_hi - y_lo) / (x_hi - x_lo)
+            dx = (times[start:stop] - x_lo).astype(out.dtype)
+            dx = dx.reshape(dx.shape + (1,) * len(grid_shape))
+            chunk = out[start:stop]
+            np.multiply(dx, slope, out=chunk)
+            chunk += y_lo
+            if masks is not None:
+                weight = dx / (x_hi - x_lo)
+                mask[start:stop] = (
+                    (row(masks, ind) & (weight != 1)) |
+                    (row(masks, ind + 1) & (weight != 0))
+                )
+        return np.ma.array(out, mask=mask)
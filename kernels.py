@@ -0,0 +1,162 @@
+import numpy as np
+
+from cache import ArrayCache
+from stages import staged
+
+# Part of the key of the moments kept in the zenith cache; bump it whenever
+# their computation changes
+KERNEL_VERSION = 1
+
+CURVES = (
+    'clear_ocean',
+    'cloud_ocean',
+    'clear_bright_ice',
+    'cloud_bright_ice',
+    'clear_dark_ice',
+    'cloud_dark_ice',
+)
+
+
+class InsolationKernels:
+
+    def __init__(self, data_set, albedos, interval=None):
+        self.data_set = data_set
+        self.albedos = albedos
+        if interval is None:
+            cmips = (data_set.sic, data_set.sit, data_set.tas, data_set.clt)
+            interval = min(
+                np.median(np.diff(cmip.window_times)) for cmip in cmips
+            )
+        self.interval = float(interval)
+        curves = albedos.curves
+        self._curves = [curves[name] for name in CURVES]
+        self._key = ArrayCache.make_key(
+            KERNEL_VERSION,
+            data_set._grid_key,
+            self.interval,
+            *[array for curve in self._curves
+              for array in (curve.zeniths, curve.albedos)]
+        )
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(interval={self.interval})'
+
+    @staged('kernels.moments')
+    def get_moments(self, start, chunk_size, delta_t):
+        times = np.arange(start, start + chunk_size + delta_t, delta_t)
+        intervals = int(round(chunk_size / self.interval))
+        steps = int(round(self.interval / delta_t))
+        assert intervals * self.interval == chunk_size
+        assert steps * delta_t == self.interval
+
+        def compute():
+            return self._compute_moments(times, intervals, steps, delta_t)
+
+        cache = self.data_set.zenith_cache
+        if cache is None:
+            return compute()
+        dates = self.data_set.start_date_np + times.astype('timedelta64[s]')
+        return cache.get_table(
+            grid_key=self._key,
+            dates=dates,
+            compute=compute,
+            kind='insolation_kernel',
+        )
+
+    def _compute_moments(self, times, intervals, steps, delta_t):
+        # Moments of cos(z) (1 - a(z)) against 1, s and s^2, where s runs
+        # from 0 to 1 across each input interval. Linearly interpolated
+        # fields and their pairwise products are polynomials of degree <= 2
+        # in s, so these moments integrate them exactly.
+        cos_zeniths = self.data_set.get_cos_zeniths(times, cache=False)
+        cos_zeniths = cos_zeniths.reshape((len(times), -1))
+        moments = np.zeros((len(CURVES), intervals, 3, cos_zeniths.shape[1]))
+        lit = np.flatnonzero((cos_zeniths > 0).any(axis=1))
+        if not lit.size:
+            return moments
+
+        s = np.linspace(0, 1, steps + 1)
+        trapz_weights = np.full(steps + 1, float(delta_t))
+        trapz_weights[[0, -1]] /= 2
+        basis = trapz_weights * np.stack([np.ones_like(s), s, s ** 2])
+        weights = np.zeros((intervals, 3, len(times)))
+        for i in range(intervals):
+            weights[i, :, i * steps:(i + 1) * steps + 1] = basis
+        weights = weights.reshape((intervals * 3, len(times)))[:, lit]
+
+        cos_zeniths = cos_zeniths[lit]
+        zeniths = self.data_set.solar.cos_to_zeniths(cos_zeniths)
+        cos_zeniths = np.maximum(cos_zeniths, 0)
+        for k, curve in enumerate(self._curves):
+            insolation = cos_zeniths * (1 - curve.get_albedo(zeniths))
+            moments[k] = (weights @ insolation).reshape(moments.shape[1:])
+        return moments
+
+    @staged('kernels.chunk')
+    def get_chunk_integral(self, start, chunk_size, delta_t):
+        moments = self.get_moments(start, chunk_size, delta_t)
+        knots = start + self.interval * np.arange(moments.shape[1] + 1)
+
+        def get_knots(cmip):
+            data = cmip.get_data(knots)
+            mask = np.ma.getmaskarray(data)
+            return data.filled(0).reshape((len(knots), -1)), mask
+
+        ice, _ = get_knots(self.data_set.sic)
+        cloud, _ = get_knots(self.data_set.clt)
+        thickness, thickness_mask = get_knots(self.data_set.sit)
+        temperature, _ = get_knots(self.data_set.tas)
+
+        def polynomial(knot_values):
+            start_values = knot_values[:-1]
+            return np.stack([
+                start_values,
+                knot_values[1:] - start_values,
+                np.zeros_like(start_values),
+            ], axis=1)
+
+        def product(a, b):
+            return np.stack([
+                a[:, 0] * b[:, 0],
+                a[:, 0] * b[:, 1] + a[:, 1] * b[:, 0],
+                a[:, 1] * b[:, 1],
+            ], axis=1)
+
+        I = polynomial(ice)
+        C = polynomial(cloud)
+        IC = product(I, C)
+        one = np.zeros_like(I)
+        one[:, 0] = 1
+
+        # The ice class and thin ice fraction are held at their mid-interval
+        # values; every class mixes curves with weights summing to 1
+        mid_thickness = (thickness[:-1] + thickness[1:]) / 2
+        mid_temperature = (temperature[:-1] + temperature[1:]) / 2
+        has_melt = mid_temperature >= (-1 + 273.15)
+        is_thin_ice = mid_thickness < 0.5
+        fh = np.minimum(
+            np.arctan(4 * mid_thickness) / np.arctan(4 * .5), 1
+        )
+        dark = (has_melt & ~is_thin_ice).astype(float)
+        bright = np.where(is_thin_ice, fh, (~has_melt).astype(float))
+        sea = np.where(is_thin_ice, 1 - fh, 0)
+        dark, bright, sea = (w[:, np.newaxis] for w in (dark, bright, sea))
+
+        M = dict(zip(CURVES, moments))
+        ice_cloud = (
+            dark * M['cloud_dark_ice'] + bright * M['cloud_bright_ice'] +
+            sea * M['cloud_ocean']
+        )
+        ice_clear = (
+            dark * M['clear_dark_ice'] + bright * M['clear_bright_ice'] +
+            sea * M['clear_ocean']
+        )
+        E = (
+            ice_cloud * IC +
+            ice_clear * (I - IC) +
+            M['cloud_ocean'] * (C - IC) +
+            M['clear_ocean'] * (one - I - C + IC)
+        )
+        chunk_integral = E.sum(axis=(0, 1)).reshape(self.data_set.lats.shape)
+        mask = thickness_mask.all(axis=0)
+        return np.ma.array(chunk_integral, mask=mask)
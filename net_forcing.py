@@ -1,51 +1,46 @@
-import dateutil
+import dateutil.relativedelta
 from datetime import timedelta
 
 import numpy as np
-import pandas as pd
-from tqdm import tqdm
 
+from fused import BLOCK_SIZE, accumulate_E
+from kernels import InsolationKernels
+from scenarios import BASELINE
+from stages import staged
 
-def _get_E(times, delta_t, data_set, albedos):
-    zeniths = data_set.get_zeniths(times)
-    cos_zeniths = np.cos(np.deg2rad(zeniths))
-    cos_zeniths[cos_zeniths < 0] = 0
+
+def _take_cells(data, cells):
+    return data.reshape((data.shape[0], -1))[:, cells]
+
+
+@staged('net_forcing.get_E')
+def _get_E(times, delta_t, data_set, albedos, cells=None, cos_zeniths=None):
+    if cos_zeniths is None:
+        cos_zeniths = data_set.get_cos_zeniths(times)
 
     ice_data = data_set.sic.get_data(times)
     cloud_data = data_set.clt.get_data(times)
     thickness = data_set.sit.get_data(times)
     temperature = data_set.tas.get_data(times)
 
+    data_set.check_times(times)
+
+    if cells is not None:
+        cos_zeniths = _take_cells(cos_zeniths, cells)
+        ice_data = _take_cells(ice_data, cells)
+        cloud_data = _take_cells(cloud_data, cells)
+        thickness = _take_cells(thickness, cells)
+        temperature = _take_cells(temperature, cells)
+
+    zeniths = data_set.solar.cos_to_zeniths(cos_zeniths)
+    cos_zeniths = np.maximum(cos_zeniths, 0)
+
     cloud_data[cloud_data.mask] = 0
 
-    sic_dates = pd.to_datetime(data_set.sic.get_date(times))
-    for cmip in (data_set.sit, data_set.tas, data_set.clt):
-        assert np.array_equal(
-            sic_dates,
-            pd.to_datetime(cmip.get_date(times)),
-        )
-    clt_dates = pd.to_datetime(data_set.clt.get_date(times))
-    assert np.array_equal(clt_dates.day, sic_dates.day)
-    assert np.array_equal(clt_dates.month, sic_dates.month)
-    assert np.array_equal(clt_dates.hour, sic_dates.hour)
-    assert np.array_equal(clt_dates.minute, sic_dates.minute)
-    assert np.array_equal(clt_dates.second, sic_dates.second)
-
-    a_Ocld = albedos.get_sea_albedo(zeniths, clear_sky=False)
-    a_Oclr = albedos.get_sea_albedo(zeniths, clear_sky=True)
-    a_Icld = albedos.get_ice_albedo(
+    a_Ocld, a_Oclr, a_Icld, a_Iclr = albedos.table.get_albedos(
         zeniths=zeniths,
         ice_thickness=thickness,
         temperature=temperature,
-        clear_sky=False,
-        sea_albedo=a_Ocld,
-    )
-    a_Iclr = albedos.get_ice_albedo(
-        zeniths=zeniths,
-        ice_thickness=thickness,
-        temperature=temperature,
-        clear_sky=True,
-        sea_albedo=a_Oclr,
     )
 
     phi = (1 - a_Icld) * (ice_data * cloud_data)
@@ -60,21 +55,309 @@ def _get_E(times, delta_t, data_set, albedos):
     return E
 
 
-def _get_E_tot(start_date, delta_t, data_set, albedos):
-    end_date = start_date + dateutil.relativedelta.relativedelta(years=1)
+@staged('net_forcing.integral')
+def _get_E_integral(times, weights, data_set, albedos, cells=None,
+                    cos_zeniths=None, scenarios=(BASELINE,), tiling=None):
+    # Weighted sum of E over steps per cell and scenario. With tiling the
+    # cells are split into tiles that are integrated on a thread pool, each
+    # writing its own columns of out. Without cos_zeniths they are computed
+    # per tile.
+    data_set.check_times(times)
+    if cos_zeniths is not None:
+        cos_zeniths = cos_zeniths.reshape((len(times), -1))
+    size = data_set.lats.size if cells is None else len(cells)
+    out = np.empty((len(scenarios), size))
+
+    def integrate(tile):
+        tile_cells = tile if cells is None else cells[tile]
+        if cos_zeniths is None:
+            tile_cos_zeniths = data_set.get_cos_zeniths(times,
+                                                        cells=tile_cells)
+        else:
+            tile_cos_zeniths = cos_zeniths[:, tile_cells]
+        out[:, tile] = _get_tile_integral(
+            times=times,
+            weights=weights,
+            data_set=data_set,
+            albedos=albedos,
+            cells=tile_cells,
+            cos_zeniths=tile_cos_zeniths,
+            scenarios=scenarios,
+        )
+
+    if tiling is None:
+        integrate(slice(None))
+    else:
+        tiling.map(integrate, size)
+    return out
+
+
+@staged('net_forcing.tile')
+def _get_tile_integral(times, weights, data_set, albedos, cells, cos_zeniths,
+                       scenarios):
+    # Accumulated in blocks of steps without building the E cube or any
+    # masked temporaries
+    fields = [
+        data_set.sic.get_data(times, cells),
+        data_set.clt.get_data(times, cells).filled(0),
+        data_set.sit.get_data(times, cells),
+        data_set.tas.get_data(times, cells),
+    ]
+    valid = ~np.ma.getmaskarray(fields[2])
+    ice, cloud, thickness, temperature = [
+        np.ma.getdata(field) for field in fields
+    ]
+
+    # Zeniths, cloud and temperature are shared by every scenario and ice
+    # albedos by every scenario with the same thickness
+    groups = {}
+    for i, scenario in enumerate(scenarios):
+        groups.setdefault(scenario.thickness_key, []).append(i)
+    outs = {
+        key: np.zeros((len(members), cos_zeniths.shape[1]))
+        for key, members in groups.items()
+    }
+    block = max(1, BLOCK_SIZE // max(1, len(scenarios) * ice.shape[1]))
+    for i in range(0, len(times), block):
+        steps = slice(i, i + block)
+        block_cos_zeniths = cos_zeniths[steps]
+        zeniths = data_set.solar.cos_to_zeniths(block_cos_zeniths)
+        insolation = np.maximum(block_cos_zeniths, 0)
+        for key, members in groups.items():
+            albedo_values = albedos.table.get_albedos(
+                zeniths=zeniths,
+                ice_thickness=scenarios[members[0]].get_thickness(
+                    thickness[steps]
+                ),
+                temperature=temperature[steps],
+            )
+            batch_ice = np.empty((len(members),) + insolation.shape,
+                                 dtype=ice.dtype)
+            for scenario_ice, member in zip(batch_ice, members):
+                scenarios[member].get_ice(ice[steps], out=scenario_ice)
+            accumulate_E(
+                outs[key],
+                weights[steps],
+                insolation,
+                batch_ice,
+                cloud[steps],
+                albedo_values,
+                valid[steps],
+            )
+    out = np.empty((len(scenarios), cos_zeniths.shape[1]))
+    for key, members in groups.items():
+        out[members] = outs[key]
+    return out
+
+
+@staged('net_forcing.lit')
+def _get_lit_integral(times, delta_t, data_set, albedos, work,
+                      scenarios=(BASELINE,), tiling=None):
+    # E is 0 wherever the sun is down, so the trapezoid reduces to the lit
+    # steps and cells weighted by dx, halved at either end of the chunk.
+    # They are found tile by tile, so cos zeniths are never computed for
+    # more than a tile of cells at once.
+    data_set.check_times(times)
+    size = data_set.lats.size
+    weights = np.full(len(times), float(delta_t))
+    weights[[0, -1]] /= 2
+    chunk_integral = np.zeros((len(scenarios), size))
+    lit_steps = np.zeros(len(times), dtype=bool)
+    lit_cell_steps = []
+
+    def integrate(tile):
+        tile_cells = np.arange(size)[tile]
+        cos_zeniths = data_set.get_cos_zeniths(times, cells=tile)
+        lit = cos_zeniths > 0
+        steps = np.flatnonzero(lit.any(axis=1))
+        cells = np.flatnonzero(lit.any(axis=0))
+        lit_steps[steps] = True
+        lit_cell_steps.append(steps.size * cells.size)
+        if steps.size:
+            chunk_integral[:, tile_cells[cells]] = _get_tile_integral(
+                times=times[steps],
+                weights=weights[steps],
+                data_set=data_set,
+                albedos=albedos,
+                cells=tile_cells[cells],
+                cos_zeniths=cos_zeniths[np.ix_(steps, cells)],
+                scenarios=scenarios,
+            )
+
+    if tiling is None:
+        integrate(slice(0, size))
+    else:
+        tiling.map(integrate, size)
+    work['steps'] += len(times)
+    work['lit_steps'] += np.count_nonzero(lit_steps)
+    work['cell_steps'] += len(times) * size
+    work['lit_cell_steps'] += sum(lit_cell_steps)
+    return chunk_integral.reshape((len(scenarios),) + data_set.lats.shape)
+
+
+@staged('net_forcing.adaptive')
+def _get_adaptive_integral(start, chunk_size, delta_t, data_set, albedos,
+                           forcing_weights, tolerance, work):
+    def evaluate(times):
+        work['evaluations'] += times.size
+        E = _get_E(
+            times=times,
+            delta_t=delta_t,
+            data_set=data_set,
+            albedos=albedos,
+            cos_zeniths=data_set.get_cos_zeniths(times, cache=False),
+        )
+        return E.filled(0).reshape((times.size, -1))
+
+    # Adaptive Simpson starting from hourly panels, refined breadth first so
+    # each level is a single vectorized evaluation. Panel errors are
+    # measured by their contribution to the annual forcing.
+    panels = max(1, int(round(chunk_size / 3600)))
+    times = np.linspace(start, start + chunk_size, 2 * panels + 1)
+    values = evaluate(times)
+    queue = [
+        (times[i], times[i + 2], values[i], values[i + 1], values[i + 2],
+         tolerance / panels)
+        for i in range(0, 2 * panels, 2)
+    ]
+    chunk_integral = np.zeros(values.shape[1])
+    while queue:
+        quarters = np.array(
+            [((3 * a + b) / 4, (a + 3 * b) / 4) for a, b, *_ in queue]
+        ).ravel()
+        quarter_values = evaluate(quarters)
+        refine = []
+        for i, (a, b, f_a, f_m, f_b, tol) in enumerate(queue):
+            f_l, f_r = quarter_values[2 * i], quarter_values[2 * i + 1]
+            coarse = (b - a) / 6 * (f_a + 4 * f_m + f_b)
+            fine = (b - a) / 12 * (f_a + 4 * f_l + 2 * f_m + 4 * f_r + f_b)
+            correction = (fine - coarse) / 15
+            error = abs(np.dot(forcing_weights, correction))
+            if error <= tol or b - a <= 2 * delta_t:
+                chunk_integral += fine + correction
+                work['error'] += error
+            else:
+                m = (a + b) / 2
+                refine.append((a, m, f_a, f_l, f_m, tol / 2))
+                refine.append((m, b, f_m, f_r, f_b, tol / 2))
+        queue = refine
+    return chunk_integral.reshape(data_set.lats.shape)
+
+
+@staged('net_forcing.period')
+def _get_E_tot(start_date, delta_t, data_set, albedos, progress=None,
+               skip_night=True, method='trapz', tolerance=1e-3,
+               report=None, scenarios=(BASELINE,), tiling=None,
+               checkpoint=None, day_cache=None, end_date=None,
+               fields=None, verbose=False):
+    from tqdm import tqdm
+
+    if method not in ('trapz', 'adaptive', 'kernel'):
+        raise ValueError(f'Unknown integration method {method!r}')
+    if method != 'trapz' and tuple(scenarios) != (BASELINE,):
+        raise ValueError(f'Scenarios are not supported by {method!r}')
+    kernels = None
+    if method == 'kernel':
+        kernels = InsolationKernels(data_set, albedos)
+        if kernels.interval % delta_t:
+            raise ValueError(
+                f'delta_t must divide the kernel interval of '
+                f'{kernels.interval:g} s'
+            )
+    year = dateutil.relativedelta.relativedelta(years=1)
+    if end_date is None:
+        end_date = start_date + year
     # stop_date = end_date - timedelta(seconds=delta_t)
 
+    data_set.set_window(start_date, end_date, (end_date, end_date + year))
+    data_set.align(start_date, end_date)
+
     date = start_date
 
     time = (start_date - data_set.start_date).total_seconds()
 
+    mask = data_set.sic.mask
     E_integral = np.ma.array(
-        np.zeros(data_set.sic.mask.shape),
-        mask=data_set.sic.mask,
+        np.zeros((len(scenarios),) + mask.shape),
+        mask=np.broadcast_to(mask, (len(scenarios),) + mask.shape),
     )
+    work = dict.fromkeys(
+        ('steps', 'lit_steps', 'cell_steps', 'lit_cell_steps', 'evaluations',
+         'error', 'cached_days'),
+        0,
+    )
+    S = 1365
+    total = (end_date - start_date).total_seconds()
+    # W m^-2 of annual forcing per unit of cell energy integral
+    forcing_weights = (
+        S * np.ma.array(data_set.areas, mask=mask).filled(0) /
+        (data_set.lat_lon_area(-90, 90, 0, 360) * total)
+    ).ravel()
     default_chunk_size = 1 * 24 * 60 * 60  # 1 day at a time
+    if fields is not None:
+        fields.start(data_set, start_date, end_date, scenarios, S)
+    start_time = time
+    state = None
+    # Fields need every day of the period, so they never resume part way
+    if checkpoint is not None and fields is None:
+        state = checkpoint.get_state(start_date, end_date)
+    if state is not None:
+        # Resume after the last day saved for this year
+        time, saved_integral, saved_work = state
+        E_integral = np.ma.array(saved_integral, mask=E_integral.mask)
+        work.update(saved_work)
+        date = start_date + timedelta(seconds=time - start_time)
+
+    def get_chunk_integral():
+        # A final chunk shorter than whole kernel intervals falls back to
+        # the trapezoid below
+        if method == 'kernel' and chunk_size % kernels.interval == 0:
+            work['steps'] += len(times)
+            work['evaluations'] += int(chunk_size / kernels.interval) + 1
+            return kernels.get_chunk_integral(
+                start=time,
+                chunk_size=chunk_size,
+                delta_t=delta_t,
+            )
+        elif method == 'adaptive':
+            work['steps'] += len(times)
+            return _get_adaptive_integral(
+                start=time,
+                chunk_size=chunk_size,
+                delta_t=delta_t,
+                data_set=data_set,
+                albedos=albedos,
+                forcing_weights=forcing_weights,
+                tolerance=tolerance * chunk_size / total,
+                work=work,
+            )
+        elif skip_night:
+            return _get_lit_integral(
+                times=times,
+                delta_t=delta_t,
+                data_set=data_set,
+                albedos=albedos,
+                work=work,
+                scenarios=scenarios,
+                tiling=tiling,
+            )
+        weights = np.full(len(times), float(delta_t))
+        weights[[0, -1]] /= 2
+        return _get_E_integral(
+            times=times,
+            weights=weights,
+            data_set=data_set,
+            albedos=albedos,
+            scenarios=scenarios,
+            tiling=tiling,
+        ).reshape((len(scenarios),) + data_set.lats.shape)
+
+    # Days are cached by the inputs and parameters that produce them
+    method_key = (method, skip_night, kernels and kernels.interval)
+
     # Trapezoidal integration: dx / 2 * (f(x_{i-1}) + f(x_i))
-    with tqdm(total=(end_date - start_date).total_seconds()) as pbar:
+    with tqdm(total=total, **(progress or {})) as pbar:
+        pbar.update(time - start_time)
         while date < end_date:
             seconds_remaining = (end_date - date).total_seconds()
             if seconds_remaining < default_chunk_size:
@@ -82,40 +365,129 @@ def _get_E_tot(start_date, delta_t, data_set, albedos):
             else:
                 chunk_size = default_chunk_size
             times = np.arange(time, time + chunk_size + delta_t, delta_t)
-            E = _get_E(
-                times=times,
-                delta_t=delta_t,
-                data_set=data_set,
-                albedos=albedos,
-            )
-            # E_integral = E_integral + np.sum(E * delta_t, axis=0)
-            chunk_integral = np.trapz(E, dx=delta_t, axis=0)
+            if day_cache is None:
+                chunk_integral = get_chunk_integral()
+            else:
+                misses = day_cache.misses
+                chunk_integral = day_cache.get_day(
+                    parts=(
+                        data_set.get_fingerprint(time, time + chunk_size),
+                        data_set._grid_key,
+                        data_set.dtype.str,
+                        albedos.table.key,
+                        method_key,
+                        tolerance * chunk_size / total,
+                        scenarios,
+                    ),
+                    date=date,
+                    chunk_size=chunk_size,
+                    delta_t=delta_t,
+                    compute=get_chunk_integral,
+                )
+                work['cached_days'] += day_cache.misses == misses
             E_integral = E_integral + chunk_integral
+            if fields is not None:
+                fields.add(date, chunk_size, chunk_integral)
             # Increase by the chunk size so the last date is repeated
             date += timedelta(seconds=chunk_size)
             time += chunk_size
 
             pbar.update(chunk_size)
+            if method in ('adaptive', 'kernel'):
+                pbar.set_postfix(evaluations=work['evaluations'])
+            elif skip_night:
+                pbar.set_postfix(skipped=_get_skipped(work))
+
+            days = int(round((time - start_time) / default_chunk_size))
+            if checkpoint is not None and checkpoint.state_days and \
+                    days % checkpoint.state_days == 0 and date < end_date:
+                checkpoint.set_state(
+                    start_date, end_date, time, E_integral, work
+                )
+
+    if verbose:
+        _print_work(work, delta_t, skip_night, method)
+    if report is not None:
+        report.update(work)
 
-    S = 1365
     E_integral = E_integral * S * data_set.areas
 
-    E_tot = np.sum(E_integral.data[~E_integral.mask])
+    E_tot = E_integral.filled(0).reshape((len(scenarios), -1)).sum(axis=1)
     return E_tot
 
 
-def get_radiative_forcing(start_date, delta_t, data_set, albedos):
+def _print_work(work, delta_t, skip_night, method):
+    if work['cached_days']:
+        print(f"{work['cached_days']} days from the day cache")
+    if method == 'adaptive':
+        print(f"adaptive: {work['evaluations']} evaluations "
+              f"({work['evaluations'] / max(work['steps'], 1):.1%} "
+              f"of fixed step), "
+              f"estimated error {work['error']:.2g} W m^-2")
+    elif method == 'kernel':
+        print(f"kernel: {work['evaluations']} field samples for "
+              f"{work['steps']} steps of {delta_t} s")
+    elif skip_night and work['steps']:
+        print(f'skipped {_get_skipped(work)} of steps, '
+              f'{_get_skipped(work, cells=True)} of cell steps')
+
+
+def _get_skipped(work, cells=False):
+    if cells:
+        skipped = 1 - work['lit_cell_steps'] / max(work['cell_steps'], 1)
+    else:
+        skipped = 1 - work['lit_steps'] / max(work['steps'], 1)
+    return f'{skipped:.1%}'
+
+
+def get_radiative_forcing(start_date, delta_t, data_set, albedos,
+                          progress=None, skip_night=True, method='trapz',
+                          tolerance=1e-3, report=None, scenarios=None,
+                          tiling=None, checkpoint=None, day_cache=None,
+                          end_date=None, fields=None, verbose=False):
+    if end_date is None:
+        end_date = start_date + dateutil.relativedelta.relativedelta(years=1)
+    if checkpoint is not None:
+        checkpoint.check_options(delta_t, method, tolerance, skip_night,
+                                 scenarios)
+    if checkpoint is not None and fields is None:
+        forcing = checkpoint.get_forcing(start_date, end_date)
+        if forcing is not None:
+            return forcing
+
     E_tot = _get_E_tot(
         start_date=start_date,
         delta_t=delta_t,
         data_set=data_set,
         albedos=albedos,
+        progress=progress,
+        skip_night=skip_night,
+        method=method,
+        tolerance=tolerance,
+        report=report,
+        scenarios=(BASELINE,) if scenarios is None else scenarios,
+        tiling=tiling,
+        checkpoint=checkpoint,
+        day_cache=day_cache,
+        end_date=end_date,
+        fields=fields,
+        verbose=verbose,
     )
 
-    end_date = start_date + dateutil.relativedelta.relativedelta(years=1)
     year_secs = (end_date - start_date).total_seconds()
     earth_surface_area = data_set.lat_lon_area(-90, 90, 0, 360)
 
     forcing = E_tot / (earth_surface_area * year_secs)
 
+    if scenarios is None:
+        forcing = forcing[0]
+    else:
+        forcing = {
+            scenario.name: forcing for scenario, forcing
+            in zip(scenarios, forcing)
+        }
+    if fields is not None:
+        fields.finish(forcing)
+    if checkpoint is not None:
+        checkpoint.set_forcing(start_date, end_date, forcing)
     return forcing
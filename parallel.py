@@ -0,0 +1,154 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from albedos import Albedos
+from data_set import DataSet
+from net_forcing import get_radiative_forcing
+
+_worker = {}
+
+
+def _init_worker(data_set_kwargs, albedos_path, albedos_cache_dir,
+                 positions):
+    # Prepared inputs are memory-mapped, so every worker shares the same
+    # pages instead of receiving pickled copies of the cubes
+    _worker['position'] = positions.get()
+    if data_set_kwargs is not None:
+        _worker['data_set'] = DataSet(**data_set_kwargs)
+    _worker['albedos'] = Albedos(albedos_path, albedos_cache_dir)
+
+
+def _get_executor(workers, data_set_kwargs, albedos_path, albedos_cache_dir):
+    positions = multiprocessing.Queue()
+    for position in range(1, workers + 1):
+        positions.put(position)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(data_set_kwargs, albedos_path, albedos_cache_dir,
+                  positions),
+    )
+
+
+def _get_year_forcing(start_date, delta_t, options):
+    position = _worker['position']
+    progress = {
+        'position': position,
+        'desc': f'worker {position} {start_date:%Y}',
+        'leave': False,
+    }
+    return get_radiative_forcing(
+        start_date=start_date,
+        delta_t=delta_t,
+        data_set=_worker['data_set'],
+        albedos=_worker['albedos'],
+        progress=progress,
+        **options,
+    )
+
+
+def iter_radiative_forcings(start_dates, delta_t, data_set_kwargs,
+                            albedos_path=None, albedos_cache_dir=None,
+                            workers=None, **options):
+    from tqdm import tqdm
+
+    # Yields (index, forcing) as years finish, in completion order
+    if data_set_kwargs.get('input_cache') is None:
+        raise ValueError('Parallel runs share inputs through input_cache')
+    if data_set_kwargs.get('windowed'):
+        raise ValueError('Windowed data sets cannot be shared by workers')
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(start_dates)))
+
+    with _get_executor(workers, data_set_kwargs, albedos_path,
+                       albedos_cache_dir) as executor:
+        futures = {
+            executor.submit(_get_year_forcing, date, delta_t, options): i
+            for i, date in enumerate(start_dates)
+        }
+        with tqdm(total=len(start_dates), position=0, desc='years') as pbar:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+                pbar.update(1)
+
+
+def get_radiative_forcings(start_dates, delta_t, data_set_kwargs,
+                           albedos_path=None, albedos_cache_dir=None,
+                           workers=None, **options):
+    forcings = [None] * len(start_dates)
+    for i, forcing in iter_radiative_forcings(
+        start_dates=start_dates,
+        delta_t=delta_t,
+        data_set_kwargs=data_set_kwargs,
+        albedos_path=albedos_path,
+        albedos_cache_dir=albedos_cache_dir,
+        workers=workers,
+        **options,
+    ):
+        forcings[i] = forcing
+    return forcings
+
+
+def _get_run_data_set(name, data_set_kwargs):
+    # Years are queued run by run, so a worker keeps only the data set of
+    # the run it last worked on
+    if _worker.get('name') != name:
+        if _worker.get('data_set') is not None:
+            _worker['data_set'].close()
+        _worker['data_set'] = DataSet(**data_set_kwargs)
+        _worker['name'] = name
+    return _worker['data_set']
+
+
+def _get_run_forcing(name, start_date, delta_t, data_set_kwargs, options):
+    position = _worker['position']
+    progress = {
+        'position': position,
+        'desc': f'worker {position} {name} {start_date:%Y}',
+        'leave': False,
+    }
+    return get_radiative_forcing(
+        start_date=start_date,
+        delta_t=delta_t,
+        data_set=_get_run_data_set(name, data_set_kwargs),
+        albedos=_worker['albedos'],
+        progress=progress,
+        **options,
+    )
+
+
+def iter_ensemble_forcings(runs, delta_t, albedos_path=None,
+                           albedos_cache_dir=None, workers=None, **options):
+    from tqdm import tqdm
+
+    # runs maps names to (start_dates, data_set_kwargs, run_options), with
+    # run_options added to options. Yields (name, index, forcing) as years
+    # finish, in completion order.
+    for _, data_set_kwargs, _ in runs.values():
+        if data_set_kwargs.get('input_cache') is None:
+            raise ValueError('Parallel runs share inputs through input_cache')
+        if data_set_kwargs.get('windowed'):
+            raise ValueError('Windowed data sets cannot be shared by workers')
+    jobs = [
+        (name, i, start_date, data_set_kwargs, {**options, **run_options})
+        for name, (start_dates, data_set_kwargs, run_options) in runs.items()
+        for i, start_date in enumerate(start_dates)
+    ]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+
+    with _get_executor(workers, None, albedos_path,
+                       albedos_cache_dir) as executor:
+        futures = {
+            executor.submit(
+                _get_run_forcing, name, start_date, delta_t, data_set_kwargs,
+                run_options,
+            ): (name, i)
+            for name, i, start_date, data_set_kwargs, run_options in jobs
+        }
+        with tqdm(total=len(jobs), position=0, desc='years') as pbar:
+            for future in as_completed(futures):
+                yield futures[future] + (future.result(),)
+                pbar.update(1)
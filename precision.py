@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+
+import baseline
+import runner
+from albedos import Albedos
+from cache import ArrayCache, ZenithCache
+from data_set import DataSet
+from net_forcing import get_radiative_forcing
+
+# Runs the same years with the same options in float64 and in DTYPE, and
+# reports the DTYPE forcing minus the float64 one
+NUM_YEARS = 3
+DTYPE = np.float32
+
+
+def get_forcings(start_dates, delta_t, data_set_kwargs, dtype, albedos,
+                 **options):
+    data_set = DataSet(dtype=dtype, **data_set_kwargs)
+    forcings = [
+        get_radiative_forcing(
+            start_date=start_date,
+            delta_t=delta_t,
+            data_set=data_set,
+            albedos=albedos,
+            **options,
+        )
+        for start_date in start_dates
+    ]
+    data_set.close()
+    return forcings
+
+
+def compare(start_dates, delta_t, data_set_kwargs, dtype=DTYPE,
+            albedos=None, **options):
+    if albedos is None:
+        albedos = Albedos()
+    references = get_forcings(start_dates, delta_t, data_set_kwargs,
+                              np.float64, albedos, **options)
+    forcings = get_forcings(start_dates, delta_t, data_set_kwargs, dtype,
+                            albedos, **options)
+    out = {}
+    for start_date, forcing, reference in zip(start_dates, forcings,
+                                              references):
+        out[start_date.isoformat()] = {
+            'forcing': forcing,
+            'reference': reference,
+            'difference': forcing - reference,
+            'relative': (forcing - reference) / reference,
+        }
+        print(start_date, forcing, reference, forcing - reference)
+    return out
+
+
+if __name__ == '__main__':
+    rad_start_dates = runner.get_start_dates(baseline.BEGIN_DATE, NUM_YEARS)
+    data_set_kwargs = dict(
+        sic_path=baseline.SIC_PATH,
+        sit_path=baseline.SIT_PATH,
+        tas_path=baseline.TAS_PATH,
+        clt_path=baseline.CLT_PATH,
+        sic_scale=.01,
+        clt_scale=.01,
+        zenith_cache=ZenithCache(directory=runner.ZENITH_CACHE_DIR),
+        compact=True,
+        regrid_cache=ArrayCache(directory=runner.REGRID_CACHE_DIR),
+        input_cache=runner.INPUT_CACHE_DIR,
+    )
+    out = compare(
+        rad_start_dates,
+        runner.DELTA_T,
+        data_set_kwargs,
+        albedos=Albedos(cache_dir=runner.ALBEDO_CACHE_DIR),
+        method=runner.METHOD,
+        tolerance=runner.TOLERANCE,
+    )
+    differences = [np.abs(year['difference']) for year in out.values()]
+    print(f'max |{np.dtype(DTYPE).name} - float64|: '
+          f'{max(differences):.3g} W m^-2')
+
+    with open(f'precision_{np.dtype(DTYPE).name}.json', 'w') as stream:
+        json.dump(out, stream, indent=4)
@@ -0,0 +1,181 @@
+import json
+
+import dateutil.relativedelta
+import numpy as np
+
+from albedos import Albedos
+from cache import ArrayCache, DayCache, ZenithCache
+from checkpoint import Checkpoint
+from data_set import DataSet
+from fields import ForcingFields
+from net_forcing import get_radiative_forcing
+from parallel import iter_ensemble_forcings
+from stages import Stages
+from tiling import Tiling
+
+# Settings shared by baseline.py, ice_free.py and ensemble.py, which only give
+# their inputs and years
+DELTA_T = 150
+# 'adaptive' integrates each day to TOLERANCE W m^-2 on the annual forcing,
+# 'kernel' weights field samples with precomputed insolation kernels
+METHOD = 'trapz'
+TOLERANCE = 1e-3
+
+SCALES = {'sic_scale': .01, 'clt_scale': .01}
+ZENITH_CACHE_DIR = 'zenith_cache'
+REGRID_CACHE_DIR = 'regrid_cache'
+ALBEDO_CACHE_DIR = 'albedo_cache'
+# Prepared inputs and the cloud climatology shared by every run
+INPUT_CACHE_DIR = 'input_cache'
+# Windowed loading bypasses the input cache
+WINDOWED = False
+# Keep only active ocean cells; needs WINDOWED off
+COMPACT = not WINDOWED
+# Field precision; np.float32 halves memory, integrals stay float64
+DTYPE = np.float64
+# Years of every run are spread over WORKERS processes when above 1
+WORKERS = 1
+# Cell tiles of each day run on a thread pool when above 1
+THREADS = 1
+TILE_SIZE = 2048
+# Finished years are kept here and skipped on a rerun with the same inputs
+# and parameters; partial years are saved every CHECKPOINT_DAYS days
+CHECKPOINT_DIR = 'checkpoints'
+CHECKPOINT_DAYS = 30
+# Daily integrals are reused across runs until their inputs change; the
+# store drops the least recently used days beyond DAY_CACHE_BYTES
+DAY_CACHE_DIR = 'day_cache'
+DAY_CACHE_BYTES = 2**32
+# Wall time and calls per stage are written next to the results when STAGES
+# is set, and peak allocations with STAGE_MEMORY, which is much slower.
+# Only this process is timed, so keep WORKERS = 1 for a full picture.
+STAGES = False
+STAGE_MEMORY = False
+# Per-cell annual and monthly energy maps and daily forcing series are
+# written to netCDF next to the results when FIELDS is set. Years with
+# fields are always computed in full rather than read from checkpoints.
+FIELDS = False
+
+
+def get_start_dates(begin_date, num_years):
+    year = dateutil.relativedelta.relativedelta(years=1)
+    return [begin_date + year * n for n in range(num_years)]
+
+
+def get_data_set_kwargs(paths):
+    return dict(
+        paths,
+        zenith_cache=ZenithCache(directory=ZENITH_CACHE_DIR),
+        windowed=WINDOWED,
+        compact=COMPACT,
+        dtype=DTYPE,
+        regrid_cache=ArrayCache(directory=REGRID_CACHE_DIR),
+        input_cache=INPUT_CACHE_DIR,
+        **SCALES,
+    )
+
+
+def iter_forcings(runs, delta_t, method, tolerance, fields=None):
+    # runs maps names to (paths, start_dates) and fields, if given, names to
+    # ForcingFields. Yields (name, start_date, forcing) as years finish.
+    albedos = Albedos(cache_dir=ALBEDO_CACHE_DIR)
+    tiling = Tiling(TILE_SIZE, THREADS) if THREADS > 1 else None
+    day_cache = DayCache(
+        max_bytes=0,
+        directory=DAY_CACHE_DIR,
+        max_disk_bytes=DAY_CACHE_BYTES,
+    )
+    options = dict(method=method, tolerance=tolerance, tiling=tiling,
+                   day_cache=day_cache)
+    run_options = {}
+    for name, (paths, _) in runs.items():
+        run_options[name] = {
+            'checkpoint': Checkpoint.for_run(
+                CHECKPOINT_DIR,
+                get_data_set_kwargs(paths),
+                albedos,
+                delta_t,
+                method=method,
+                tolerance=tolerance,
+                state_days=CHECKPOINT_DAYS,
+            ),
+            'fields': (fields or {}).get(name),
+        }
+    try:
+        if WORKERS > 1:
+            # Inputs are prepared here once per run so workers only ever
+            # load them from the input cache
+            for name, (paths, _) in runs.items():
+                print(f'Preparing {name}')
+                DataSet(**get_data_set_kwargs(paths)).close()
+            run_forcings = iter_ensemble_forcings(
+                runs={
+                    name: (start_dates, get_data_set_kwargs(paths),
+                           run_options[name])
+                    for name, (paths, start_dates) in runs.items()
+                },
+                delta_t=delta_t,
+                albedos_cache_dir=ALBEDO_CACHE_DIR,
+                workers=WORKERS,
+                **options,
+            )
+            for name, i, forcing in run_forcings:
+                yield name, runs[name][1][i], forcing
+        else:
+            for name, (paths, start_dates) in runs.items():
+                print(f'Running {name}')
+                data_set = DataSet(**get_data_set_kwargs(paths))
+                for start_date in start_dates:
+                    forcing = get_radiative_forcing(
+                        start_date=start_date,
+                        delta_t=delta_t,
+                        data_set=data_set,
+                        albedos=albedos,
+                        verbose=True,
+                        **options,
+                        **run_options[name],
+                    )
+                    yield name, start_date, forcing
+                print(data_set.zenith_cache)
+                data_set.close()
+    finally:
+        if tiling is not None:
+            tiling.close()
+
+
+def write_forcings(path, forcings):
+    out = {
+        date.isoformat(): forcing for date, forcing
+        in sorted(forcings.items())
+    }
+    out['mean'] = np.mean(list(forcings.values()))
+    out['std'] = np.std(list(forcings.values()))
+    with open(path, 'w') as stream:
+        json.dump(out, stream, indent=4)
+
+
+def run(name, paths, begin_date, num_years):
+    # Results are written to <name>_delta_t_<DELTA_T>.json as each year
+    # finishes
+    stages = Stages(memory=STAGE_MEMORY) if STAGES else None
+    if stages is not None:
+        stages.start()
+    out_path = f'{name}_delta_t_{DELTA_T}.json'
+    fields = None
+    if FIELDS:
+        fields = {name: ForcingFields(out_path.replace('.json', '_fields'))}
+    forcings = {}
+    for _, start_date, forcing in iter_forcings(
+        {name: (paths, get_start_dates(begin_date, num_years))},
+        DELTA_T,
+        METHOD,
+        TOLERANCE,
+        fields=fields,
+    ):
+        print(start_date, forcing)
+        forcings[start_date] = forcing
+        write_forcings(out_path, forcings)
+    if stages is not None:
+        stages.stop()
+        stages.print()
+        stages.write(out_path.replace('.json', '_stages.json'))
@@ -0,0 +1,92 @@
+import json
+from datetime import datetime
+
+import numpy as np
+
+
+class Scenario:
+
+    def __init__(self, name, sic_scale=1, sit_scale=1, sit_offset=0):
+        self.name = name
+        self.sic_scale = sic_scale
+        self.sit_scale = sit_scale
+        self.sit_offset = sit_offset
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r}, ' \
+            f'sic_scale={self.sic_scale}, sit_scale={self.sit_scale}, ' \
+            f'sit_offset={self.sit_offset})'
+
+    @property
+    def thickness_key(self):
+        # Scenarios with the same key share their ice albedos
+        return (self.sit_scale, self.sit_offset)
+
+    def get_ice(self, ice, out):
+        np.multiply(ice, self.sic_scale, out=out)
+        if self.sic_scale > 1:
+            np.minimum(out, 1, out=out)
+        return out
+
+    def get_thickness(self, thickness):
+        if self.thickness_key == (1, 0):
+            return thickness
+        thickness = thickness * self.sit_scale - self.sit_offset
+        return np.maximum(thickness, 0, out=thickness)
+
+
+BASELINE = Scenario('baseline')
+
+
+def get_differences(forcings, reference=None):
+    if reference is None:
+        reference = next(iter(forcings))
+    return {
+        name: forcing - forcings[reference]
+        for name, forcing in forcings.items()
+    }
+
+
+if __name__ == '__main__':
+    import baseline
+    import runner
+    from albedos import Albedos
+    from cache import ArrayCache, ZenithCache
+    from data_set import DataSet
+    from net_forcing import get_radiative_forcing
+
+    SCENARIOS = (
+        BASELINE,
+        Scenario('half_sic', sic_scale=.5),
+        Scenario('ice_free', sic_scale=0),
+        Scenario('thin_sit', sit_scale=.5),
+    )
+    BEGIN_DATE = datetime(1979, 1, 1)
+
+    data_set = DataSet(
+        sic_path=baseline.SIC_PATH,
+        sit_path=baseline.SIT_PATH,
+        tas_path=baseline.TAS_PATH,
+        clt_path=baseline.CLT_PATH,
+        sic_scale=.01,
+        clt_scale=.01,
+        zenith_cache=ZenithCache(directory=runner.ZENITH_CACHE_DIR),
+        compact=True,
+        regrid_cache=ArrayCache(directory=runner.REGRID_CACHE_DIR),
+        input_cache=runner.INPUT_CACHE_DIR,
+    )
+    forcings = get_radiative_forcing(
+        start_date=BEGIN_DATE,
+        delta_t=runner.DELTA_T,
+        data_set=data_set,
+        albedos=Albedos(cache_dir=runner.ALBEDO_CACHE_DIR),
+        scenarios=SCENARIOS,
+    )
+    data_set.close()
+    out = {
+        'forcing': forcings,
+        'difference': get_differences(forcings),
+    }
+    print(json.dumps(out, indent=4))
+    with open(f'scenarios_delta_t_{runner.DELTA_T}.json', 'w') as stream:
+        json.dump(out, stream, indent=4)
@@ -0,0 +1,88 @@
+import numpy as np
+
+from stages import staged
+
+EARTH_AXIS_INCLINATION = 23.45
+
+
+class SolarPosition:
+
+    def __init__(self, lats, lons, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.shape = np.shape(lats)
+        rlats = np.deg2rad(np.asarray(lats, dtype=np.float64)).ravel()
+        rlons = np.deg2rad(np.asarray(lons, dtype=np.float64)).ravel()
+        # cos(z) = sin(lat) sin(dec) + cos(lat) cos(dec) cos(h + lon), with
+        # cos(h + lon) expanded so only the hour angle h depends on time
+        self._cell_terms = np.stack([
+            np.sin(rlats),
+            np.cos(rlats) * np.cos(rlons),
+            np.cos(rlats) * np.sin(rlons),
+        ]).astype(self.dtype)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(shape={self.shape}, ' \
+            f'dtype={self.dtype})'
+
+    @staticmethod
+    def get_time_terms(dates):
+        # Same model as pysolar.solar.get_altitude_fast, which resolves the
+        # solar time to the minute
+        dates = np.asarray(dates).astype('datetime64[m]').ravel()
+        days = dates.astype('datetime64[D]')
+        day = (days - days.astype('datetime64[Y]')).astype(int) + 1
+        minutes = (dates - days).astype(int)
+        declination = np.deg2rad(
+            EARTH_AXIS_INCLINATION * np.sin((2 * np.pi / 365.0) * (day - 81))
+        )
+        b = 2 * np.pi / 364.0 * (day - 81)
+        equation_of_time = (
+            9.87 * np.sin(2 * b) - 7.53 * np.cos(b) - 1.5 * np.sin(b)
+        )
+        hour_angle = np.deg2rad(15 * ((minutes + equation_of_time) / 60 - 12))
+        cos_declination = np.cos(declination)
+        return np.stack([
+            np.sin(declination),
+            cos_declination * np.cos(hour_angle),
+            -cos_declination * np.sin(hour_angle),
+        ], axis=1)
+
+    @staged('solar.cos_zeniths')
+    def get_cos_zeniths(self, dates, cells=None):
+        # Given flat cells, a slice or indices, only their (steps, cells)
+        # table is computed
+        time_terms = self.get_time_terms(dates).astype(self.dtype)
+        if cells is not None:
+            return time_terms @ self._cell_terms[:, cells]
+        cos_zeniths = time_terms @ self._cell_terms
+        return cos_zeniths.reshape((len(time_terms),) + self.shape)
+
+    def get_zeniths(self, dates):
+        return self.cos_to_zeniths(self.get_cos_zeniths(dates))
+
+    @staticmethod
+    def cos_to_zeniths(cos_zeniths):
+        return np.rad2deg(np.arccos(np.clip(cos_zeniths, -1, 1)))
+
+
+def compare_with_pysolar(lats, lons, dates, dtype=np.float64):
+    import pysolar
+
+    dates = np.asarray(dates, dtype='datetime64[s]')
+    expected = 90 - pysolar.solar.get_altitude_fast(
+        lats, lons, dates.reshape((dates.size,) + (1,) * np.ndim(lats))
+    )
+    zeniths = SolarPosition(lats, lons, dtype).get_zeniths(dates)
+    return np.abs(zeniths - expected).max()
+
+
+if __name__ == '__main__':
+    lons, lats = np.meshgrid(np.arange(0, 360, 2.5), np.arange(65, 90, 2.))
+    rng = np.random.default_rng(0)
+    start = np.datetime64('1979-01-01T00:00:00')
+    seconds = rng.integers(0, 90 * 365 * 24 * 60 * 60, 2000)
+    dates = np.sort(start + seconds.astype('timedelta64[s]'))
+    for dtype in (np.float64, np.float32):
+        error = compare_with_pysolar(lats, lons, dates, dtype)
+        print(f'{np.dtype(dtype).name}: max |zenith - pysolar| = '
+              f'{error:.3g} deg')
@@ -0,0 +1,137 @@
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+# Stages are timed only while a Stages object is started; otherwise stage()
+# hands back a shared no-op context
+_active = None
+_disabled = nullcontext()
+
+
+def stage(name):
+    if _active is None:
+        return _disabled
+    return _Stage(_active, name)
+
+
+class _Stage:
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.stages._enter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stages._exit(self)
+
+
+class Stages:
+
+    def __init__(self, memory=False, hook=None):
+        # memory traces allocations, which numpy reports to tracemalloc, at a
+        # large cost in speed. hook(name, event) is called with 'enter' and
+        # 'exit' around every stage, e.g. to drive an external profiler.
+        self.memory = memory
+        self.hook = hook
+        self.totals = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(memory={self.memory}, ' \
+            f'stages={len(self.totals)})'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        global _active
+        if self.memory:
+            tracemalloc.start()
+        _active = self
+
+    def stop(self):
+        global _active
+        _active = None
+        if self.memory:
+            tracemalloc.stop()
+
+    def _enter(self, stage):
+        if self.hook is not None:
+            self.hook(stage.name, 'enter')
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = []
+            # The peak is reset for the stage, so the enclosing stage keeps
+            # its own peak so far to combine on exit
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            stack.append(stage)
+            stage.current = current
+            stage.peak = 0
+            tracemalloc.reset_peak()
+        stage.start = time.perf_counter()
+
+    def _exit(self, stage):
+        seconds = time.perf_counter() - stage.start
+        peak_bytes = 0
+        if self.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], stage.peak)
+            peak_bytes = max(peak - stage.current, 0)
+            stack = self._local.stack
+            stack.pop()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+        with self._lock:
+            total = self.totals.get(stage.name)
+            if total is None:
+                total = self.totals[stage.name] = {
+                    'calls': 0, 'seconds': 0., 'peak_bytes': 0,
+                }
+            total['calls'] += 1
+            total['seconds'] += seconds
+            total['peak_bytes'] = max(total['peak_bytes'], peak_bytes)
+        if self.hook is not None:
+            self.hook(stage.name, 'exit')
+
+    def get_summary(self):
+        # Nested stages are included in their parents' times
+        with self._lock:
+            return dict(sorted(
+                self.totals.items(), key=lambda item: -item[1]['seconds']
+            ))
+
+    def write(self, path):
+        with open(path, 'w') as stream:
+            json.dump(self.get_summary(), stream, indent=4)
+
+    def print(self):
+        for name, total in self.get_summary().items():
+            print(f"{name:32} {total['calls']:10d} calls "
+                  f"{total['seconds']:10.3f} s "
+                  f"{total['peak_bytes'] / 2**20:10.1f} MiB")
+
+
+def staged(name):
+    # Method form of stage(); when disabled the only cost is one check
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with _Stage(_active, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
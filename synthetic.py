@@ -0,0 +1,129 @@
+import os
+import sys
+from datetime import datetime
+
+import netCDF4
+import numpy as np
+
+# Synthetic inputs laid out like the GFDL-CM3 and NCEP files, for timing runs
+# without the model archives. Values follow a seasonal cycle plus noise.
+MODEL_UNITS = 'days since 1850-01-01'
+NCEP_UNITS = 'hours since 1800-01-01 00:00:0.0'
+
+
+def _write(path, key, lats, lons, times, units, data):
+    with netCDF4.Dataset(path, 'w', format='NETCDF4_CLASSIC') as ds:
+        ds.createDimension('time', None)
+        if lats.ndim == 1:
+            ds.createDimension('lat', lats.size)
+            ds.createDimension('lon', lons.size)
+            lat = ds.createVariable('lat', 'f4', ('lat',))
+            lon = ds.createVariable('lon', 'f4', ('lon',))
+            dims = ('time', 'lat', 'lon')
+        else:
+            # Curvilinear ocean grids carry 2-D coordinates
+            ds.createDimension('rlat', lats.shape[0])
+            ds.createDimension('rlon', lats.shape[1])
+            lat = ds.createVariable('lat', 'f8', ('rlat', 'rlon'))
+            lon = ds.createVariable('lon', 'f8', ('rlat', 'rlon'))
+            dims = ('time', 'rlat', 'rlon')
+        lat[:] = lats
+        lon[:] = lons
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = units
+        time.calendar = 'standard'
+        time[:] = times
+        variable = ds.createVariable(key, 'f4', dims, fill_value=1e20)
+        variable.units = '1'
+        variable.long_name = key
+        variable[:] = data
+
+
+def _get_times(year, per_day, units):
+    start = datetime(year, 1, 1)
+    days = (datetime(year + 1, 1, 1) - start).days
+    times = np.arange(days * per_day) / per_day
+    return netCDF4.date2num(start, units) + times * (
+        24 if units.startswith('hours') else 1
+    )
+
+
+def _get_seasons(times, per_day, shape):
+    day_of_year = np.arange(times.size) / per_day
+    return np.cos(2 * np.pi * day_of_year / 365).reshape(
+        (-1,) + (1,) * len(shape)
+    )
+
+
+def get_ocean_grid(step, min_lat=40):
+    lats, lons = np.meshgrid(
+        np.arange(min_lat, 90, step), np.arange(-180, 180, step),
+        indexing='ij',
+    )
+    # A block of land so the masks are not trivial
+    land = (lons > 30) & (lons < 80) & (lats < 82)
+    return lats, lons, land
+
+
+def write_data_set(directory, ocean_step=3., atmosphere_step=4.,
+                   cloud_step=8., years=(1979, 1980), seed=0):
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ocean_lats, ocean_lons, land = get_ocean_grid(ocean_step)
+    atmosphere_lats = np.arange(-90 + atmosphere_step / 2, 90,
+                                atmosphere_step)
+    atmosphere_lons = np.arange(0, 360, atmosphere_step)
+    for year in years:
+        suffix = f'SYN_historical_r1i1p1_{year}0101-{year}1231.nc'
+        times = _get_times(year, 1, MODEL_UNITS)
+        seasons = _get_seasons(times, 1, land.shape)
+        shape = times.shape + land.shape
+        mask = np.broadcast_to(land, shape)
+        sic = 80 + 30 * seasons - 2 * (90 - ocean_lats)
+        sic = np.clip(sic + rng.normal(0, 5, shape), 0, 100)
+        sit = np.clip(1.5 + seasons + rng.normal(0, .3, shape), 0, None)
+        for key, data in (('sic', sic), ('sit', sit)):
+            _write(
+                os.path.join(directory, f'{key}_day_{suffix}'), key,
+                ocean_lats, ocean_lons, times, MODEL_UNITS,
+                np.ma.array(data, mask=mask),
+            )
+
+        times = _get_times(year, 8, MODEL_UNITS)
+        shape = times.shape + (atmosphere_lats.size, atmosphere_lons.size)
+        tas = 255 - 20 * _get_seasons(times, 8, shape[1:])
+        _write(
+            os.path.join(
+                directory,
+                f'tas_3hr_SYN_historical_r1i1p1_{year}010100-{year}123121.nc',
+            ),
+            'tas', atmosphere_lats, atmosphere_lons, times, MODEL_UNITS,
+            tas + rng.normal(0, 2, shape),
+        )
+
+    # The cloud climatology needs whole leap cycles from a leap year, with
+    # latitudes descending like the Gaussian grid
+    cloud_lats = np.arange(90 - cloud_step / 2, -90, -cloud_step)
+    cloud_lons = np.arange(0, 360, cloud_step)
+    for year in range(1980, 1984):
+        times = _get_times(year, 4, NCEP_UNITS)
+        shape = times.shape + (cloud_lats.size, cloud_lons.size)
+        _write(
+            os.path.join(directory, f'tcdc.eatm.gauss.{year}.nc'), 'tcdc',
+            cloud_lats, cloud_lons, times, NCEP_UNITS,
+            np.clip(60 + rng.normal(0, 25, shape), 0, 100),
+        )
+    return get_paths(directory)
+
+
+def get_paths(directory):
+    return {
+        'sic_path': os.path.join(directory, 'sic_day_SYN_historical*'),
+        'sit_path': os.path.join(directory, 'sit_day_SYN_historical*'),
+        'tas_path': os.path.join(directory, 'tas_3hr_SYN_historical_*.nc'),
+        'clt_path': os.path.join(directory, 'tcdc.eatm.gauss.198*.nc'),
+    }
+
+
+if __name__ == '__main__':
+    print(write_data_set(sys.argv[1] if len(sys.argv) > 1 else 'synthetic'))
@@ -0,0 +1,29 @@
+import json
+import os
+
+import benchmark
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_benchmark_smoke(tmp_path, monkeypatch):
+    # Runs every stage once on the smallest synthetic inputs
+    monkeypatch.chdir(REPO_DIR)
+    monkeypatch.setattr(benchmark, 'DELTA_TS', (3600,))
+    out_path = tmp_path / 'benchmark.json'
+    # The coarsest grid has the largest step
+    name = max(benchmark.RESOLUTIONS,
+               key=lambda name: benchmark.RESOLUTIONS[name]['ocean_step'])
+    results = benchmark.main(
+        data_dir=str(tmp_path),
+        out_path=str(out_path),
+        resolutions={name: benchmark.RESOLUTIONS[name]},
+        imports=False,
+    )
+
+    stages = {result['stage'] for result in results}
+    assert stages == {'startup', 'regrid', 'get_data', 'get_albedos',
+                      'get_E_integral', 'get_lit_integral', 'year'}
+    assert all(result['seconds'] > 0 for result in results)
+    with open(out_path) as stream:
+        assert json.load(stream)['results'] == results
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import fused
+
+
+def get_inputs(seed, scenarios=3, steps=40, cells=25):
+    rng = np.random.default_rng(seed)
+    albedos = tuple(rng.uniform(.05, .8, (steps, cells)) for _ in range(4))
+    return dict(
+        out=rng.normal(size=(scenarios, cells)),
+        weights=rng.uniform(0, 300, steps),
+        cos_zeniths=np.maximum(rng.uniform(-.5, 1, (steps, cells)), 0),
+        ice=rng.uniform(0, 1, (scenarios, steps, cells)),
+        cloud=rng.uniform(0, 1, (steps, cells)),
+        albedos=albedos,
+        valid=rng.uniform(size=(steps, cells)) > .2,
+    )
+
+
+def accumulate(function, inputs):
+    # Both paths use ice and the albedos as scratch space
+    out = inputs['out'].copy()
+    a_Ocld, a_Oclr, a_Icld, a_Iclr = (
+        albedo.copy() for albedo in inputs['albedos']
+    )
+    function(out, inputs['weights'], inputs['cos_zeniths'],
+             inputs['ice'].copy(), inputs['cloud'], a_Ocld, a_Oclr, a_Icld,
+             a_Iclr, inputs['valid'])
+    return out
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_numba_matches_numpy(seed):
+    numba = pytest.importorskip('numba')
+    inputs = get_inputs(seed)
+    expected = accumulate(fused._accumulate_numpy, inputs)
+    result = accumulate(numba.njit(fused._accumulate_loops), inputs)
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-9)
+
+
+def test_accumulate_E_matches_numpy():
+    inputs = get_inputs(3)
+    expected = accumulate(fused._accumulate_numpy, inputs)
+    out = inputs['out'].copy()
+    fused.accumulate_E(
+        out, inputs['weights'], inputs['cos_zeniths'], inputs['ice'].copy(),
+        inputs['cloud'], tuple(a.copy() for a in inputs['albedos']),
+        inputs['valid'],
+    )
+    np.testing.assert_allclose(out, expected, rtol=1e-12, atol=1e-9)
@@ -0,0 +1,56 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import synthetic
+from albedos import Albedos
+from data_set import DataSet
+from net_forcing import get_radiative_forcing
+
+ALBEDOS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'Albedos.csv')
+# The same default as TOLERANCE in the drivers, in W m^-2 of annual forcing
+TOLERANCE = 1e-3
+
+
+@pytest.fixture(scope='module')
+def data_set(tmp_path_factory):
+    paths = synthetic.write_data_set(str(tmp_path_factory.mktemp('inputs')))
+    data_set = DataSet(sic_scale=.01, clt_scale=.01, compact=True, **paths)
+    yield data_set
+    data_set.close()
+
+
+def get_forcing(data_set, method, delta_t=600, **kwargs):
+    return get_radiative_forcing(
+        start_date=kwargs.pop('start_date', datetime(1979, 1, 1)),
+        delta_t=delta_t,
+        data_set=data_set,
+        albedos=Albedos(ALBEDOS_PATH),
+        method=method,
+        progress={'disable': True},
+        **kwargs,
+    )
+
+
+def test_kernel_matches_trapz(data_set):
+    kernel = get_forcing(data_set, 'kernel')
+    trapz = get_forcing(data_set, 'trapz')
+    assert kernel > 0
+    assert abs(kernel - trapz) < TOLERANCE
+
+
+def test_kernel_partial_interval(data_set):
+    # The final hour is shorter than the 3-hourly kernel interval
+    options = dict(start_date=datetime(1979, 6, 1),
+                   end_date=datetime(1979, 6, 2, 1))
+    kernel = get_forcing(data_set, 'kernel', **options)
+    trapz = get_forcing(data_set, 'trapz', **options)
+    np.testing.assert_allclose(kernel, trapz, rtol=1e-3)
+
+
+def test_kernel_delta_t_must_divide_interval(data_set):
+    with pytest.raises(ValueError):
+        get_forcing(data_set, 'kernel', delta_t=7200)
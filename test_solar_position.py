@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from solar_position import SolarPosition, compare_with_pysolar
+
+pytest.importorskip('pysolar')
+
+
+def get_dates(count, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('1979-01-01T00:00:00')
+    seconds = rng.integers(0, 90 * 365 * 24 * 60 * 60, count)
+    return np.sort(start + seconds.astype('timedelta64[s]'))
+
+
+def test_float64_global():
+    lons, lats = np.meshgrid(np.arange(0, 360, 7.5), np.arange(-88, 90, 8.))
+    error = compare_with_pysolar(lats, lons, get_dates(200), np.float64)
+    assert error < 1e-10
+
+
+@pytest.mark.parametrize('dtype, tolerance', [
+    (np.float64, 1e-10),
+    # arccos loses precision near the zenith, which never reaches the
+    # Arctic cells the model uses
+    (np.float32, 1e-4),
+])
+def test_arctic(dtype, tolerance):
+    lons, lats = np.meshgrid(np.arange(0, 360, 2.5), np.arange(65, 90, 2.))
+    error = compare_with_pysolar(lats, lons, get_dates(500), dtype)
+    assert error < tolerance
+
+
+def test_cells():
+    # A tile of cells gets exactly the columns of the full table
+    lons, lats = np.meshgrid(np.arange(0, 360, 7.5), np.arange(-88, 90, 8.))
+    solar = SolarPosition(lats, lons)
+    dates = get_dates(50)
+    full = solar.get_cos_zeniths(dates).reshape((len(dates), -1))
+    cells = np.arange(3, full.shape[1], 7)
+    assert np.array_equal(solar.get_cos_zeniths(dates, cells), full[:, cells])
+    assert np.array_equal(solar.get_cos_zeniths(dates, slice(5, 40)),
+                          full[:, 5:40])
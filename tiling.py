@@ -0,0 +1,43 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Tiling:
+
+    def __init__(self, tile_size=2048, threads=None):
+        # Flat cells are ordered by row, so a tile is a band of latitudes
+        self.tile_size = tile_size
+        self.threads = threads or os.cpu_count()
+        self._executor = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(tile_size={self.tile_size}, ' \
+            f'threads={self.threads})'
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def get_tiles(self, size):
+        return [
+            slice(start, min(start + self.tile_size, size))
+            for start in range(0, size, self.tile_size)
+        ]
+
+    def map(self, function, size):
+        tiles = self.get_tiles(size)
+        if self.threads == 1 or len(tiles) == 1:
+            for tile in tiles:
+                function(tile)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        futures = [self._executor.submit(function, tile) for tile in tiles]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None